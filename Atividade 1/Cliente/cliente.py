@@ -1,11 +1,14 @@
 import pika
 import threading
 import sys
-import json
+import os
 import time
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
+
+# codec compartilhado com os microsservicos (Leilao/codecMensagens.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Leilao'))
+import codecMensagens
+import assinaturas
+import consumoLotes
 
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'leilao_exchange'
@@ -13,6 +16,17 @@ ROUTING_KEY_LEILAO_INICIADO = 'leilao_iniciado'
 ROUTING_KEY_LANCE_REALIZADO = 'lance_realizado'
 ROUTING_KEY_LEILAO_PART = 'leilao_'
 
+# formato dos lances enviados; o lanceMS decodifica pelo content_type
+FORMATO_MENSAGENS = codecMensagens.BINARIO
+# esquema de assinatura dos lances; o lanceMS identifica pela chave publica gravada.
+# RSA continua o padrao (compativel com chaves e verificadores ja existentes); ed25519
+# (python cliente.py ID ed25519) gera a chave e assina muito mais rapido, com assinatura
+# de 64 bytes em vez de 256, mas so e aceito por um lanceMS com assinaturas.py
+ESQUEMA_ASSINATURA = assinaturas.RSA_2048
+# notificacoes recebidas com ack manual, no maximo PREFETCH em voo
+PREFETCH = 50
+LOTE_MAX = 50
+
 client_id = 0
 queue_name = None
 
@@ -28,9 +42,9 @@ def consume():
     queue_name = result.method.queue
     channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=ROUTING_KEY_LEILAO_INICIADO)
 
-    # chamada quando receber uma mensagem
+    # chamada para cada mensagem de um lote recebido
     def callback(ch, method, properties, body):
-        json_data = json.loads(body)
+        json_data = codecMensagens.decode_mensagem(properties, body)
         if method.routing_key == ROUTING_KEY_LEILAO_INICIADO:
             # se receber roteada de leilao iniciado, notifica o usuario
             print("========== Novo leilão =========")
@@ -53,14 +67,14 @@ def consume():
             print("================================")
 
     # inicia escuta
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
+    consumoLotes.BatchConsumer(channel, consumoLotes.cada_mensagem(callback), PREFETCH, LOTE_MAX).consume(queue_name)
     print(f"Esperando leilões...")
     print(f"Se deseja participar de algum, digite o ID do leilão seguido do valor lance que deseja fazer (apenas números)")
     print(f"Por exemplo, para fazer o lance 100 no leilão 0, digite: 0 100")
     print(f"Se o lance foi bem sucedido, você começará a receber atualizações sobre o leilão, incluindo o seu próprio lance")
     channel.start_consuming()
 
-def publish(private_key):
+def publish(signer):
     # abre conexao e exchange para publicar mensagens
     connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
     channel = connection.channel()
@@ -80,26 +94,22 @@ def publish(private_key):
                 channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
 
                 # monta a mensagem
-                message = json.dumps({
+                message = {
                     "lei_id": int(id_leilao),
                     "cli_id": client_id,
                     "lance": int(lance)
-                })
-
-                # assina a mensagem
-                key = RSA.import_key(private_key)
-                h = SHA256.new(message.encode())
-                signature = pkcs1_15.new(key).sign(h)
-                message_signed = json.dumps({
-                    "message": message,
-                    "signature": signature.hex()
-                })   
-                    
+                }
+
+                # assina a forma canonica do lance e envia a assinatura junto, na mesma mensagem
+                message['signature'] = signer.sign(codecMensagens.bytes_assinados(message))
+                body, content_type = codecMensagens.encode(ROUTING_KEY_LANCE_REALIZADO, message, FORMATO_MENSAGENS)
+
                 # publica a mensagem com a rota apropriada
                 channel.basic_publish(
                     exchange=EXCHANGE_NAME,
                     routing_key=ROUTING_KEY_LANCE_REALIZADO,
-                    body=message_signed
+                    body=body,
+                    properties=codecMensagens.propriedades(content_type)
                 )
                 print(f"Lance de '{lance}' enviado para leilão com ID '{id_leilao}'")
             else:
@@ -115,13 +125,18 @@ if __name__ == "__main__":
         print("Inicializando cliente com ID default (0)")
     else:
         client_id = int(sys.argv[1])
+    # segundo argumento opcional: esquema de assinatura (ed25519, p256 ou rsa)
+    esquema = sys.argv[2] if len(sys.argv) > 2 else ESQUEMA_ASSINATURA
+    if esquema not in assinaturas.ESQUEMAS:
+        print(f"Esquema de assinatura invalido, use um de: {', '.join(assinaturas.ESQUEMAS)}")
+        sys.exit(1)
 
-    key = RSA.generate(2048)
-    private_key = key.export_key()
-    public_key = key.publickey().export_key()
+    # chave e assinador montados uma vez; cada lance so assina
+    key = assinaturas.gera_chave(esquema)
+    signer = assinaturas.Signer(key)
     with open("public_key_{}.pem".format(client_id), "wb") as f:
-        f.write(public_key)
+        f.write(assinaturas.exporta_publica(key))
     
 
     threading.Thread(target=consume, daemon=True).start()
-    publish(private_key)
\ No newline at end of file
+    publish(signer)
\ No newline at end of file
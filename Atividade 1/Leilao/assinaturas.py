@@ -0,0 +1,110 @@
+# Esquemas de assinatura dos lances: o cliente assina codecMensagens.bytes_assinados(lance)
+# e o lanceMS verifica com a chave publica do cliente.
+#   - ED25519 (opcional no cliente): chave gerada em microssegundos, assinatura de 64 bytes;
+#   - P256: ECDSA sobre SHA-256, assinatura de 64 bytes (r || s);
+#   - RSA_2048 (padrao do cliente): PKCS#1 v1.5 sobre SHA-256, assinatura de 256 bytes, como antes.
+# O esquema vem da chave publica do cliente (o PEM traz o algoritmo), entao o lanceMS
+# aceita qualquer um deles sem campo extra na mensagem; o tamanho da assinatura recebida
+# e conferido contra o do esquema antes de verificar.
+#
+# Uso:
+#     key = assinaturas.gera_chave(assinaturas.ED25519)
+#     signer = assinaturas.Signer(key)          # montado uma vez por cliente
+#     signature = signer.sign(dados)
+#     assinaturas.Signer(assinaturas.importa_chave(pem)).verify(dados, signature)
+#
+# python assinaturas.py mede geracao de chave, assinatura e verificacao de cada esquema.
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import DSS, eddsa, pkcs1_15
+
+RSA_2048 = 'rsa'
+ED25519 = 'ed25519'
+P256 = 'p256'
+ESQUEMAS = (ED25519, P256, RSA_2048)
+
+# nome da curva em pycryptodome -> esquema
+CURVAS = {'Ed25519': ED25519, 'NIST P-256': P256}
+
+def gera_chave(esquema=ED25519):
+    if esquema == RSA_2048:
+        return RSA.generate(2048)
+    if esquema in (ED25519, P256):
+        return ECC.generate(curve=esquema)
+    raise ValueError(f"Esquema de assinatura desconhecido: {esquema}")
+
+def esquema_da_chave(key):
+    if isinstance(key, RSA.RsaKey):
+        return RSA_2048
+    if isinstance(key, ECC.EccKey) and key.curve in CURVAS:
+        return CURVAS[key.curve]
+    raise ValueError(f"Chave de tipo nao suportado: {key!r}")
+
+def importa_chave(pem):
+    # RSA e ECC tem importadores separados; o PEM diz qual serve
+    try:
+        return RSA.import_key(pem)
+    except ValueError:
+        return ECC.import_key(pem)
+
+def exporta_publica(key):
+    if isinstance(key, RSA.RsaKey):
+        return key.publickey().export_key()
+    return key.public_key().export_key(format='PEM').encode()
+
+class Signer:
+    """Signs or verifies bid bytes with one key; verify raises ValueError on a bad signature."""
+
+    def __init__(self, key):
+        self.esquema = esquema_da_chave(key)
+        if self.esquema == RSA_2048:
+            self._scheme = pkcs1_15.new(key)
+            self.signature_size = key.size_in_bytes()
+        elif self.esquema == ED25519:
+            self._scheme = eddsa.new(key, 'rfc8032')
+            self.signature_size = 64
+        else:
+            self._scheme = DSS.new(key, 'fips-186-3')
+            self.signature_size = 64
+
+    def sign(self, data):
+        if self.esquema == ED25519:
+            return self._scheme.sign(data)
+        return self._scheme.sign(SHA256.new(data))
+
+    def verify(self, data, signature):
+        if len(signature) != self.signature_size:
+            raise ValueError(f"Assinatura de {len(signature)} bytes, esperado {self.signature_size} ({self.esquema})")
+        if self.esquema == ED25519:
+            self._scheme.verify(data, signature)
+        else:
+            self._scheme.verify(SHA256.new(data), signature)
+
+def benchmark(repeticoes=2000):
+    import time
+
+    data = bytes(25)
+    print(f"{'esquema':<8} {'chaves/s':>10} {'assin./s':>10} {'verif./s':>10} {'bytes':>6} {'hex':>5}")
+    for esquema in ESQUEMAS:
+        n_chaves = 10 if esquema == RSA_2048 else repeticoes
+        inicio = time.perf_counter()
+        for _ in range(n_chaves):
+            key = gera_chave(esquema)
+        chaves = n_chaves / (time.perf_counter() - inicio)
+
+        signer = Signer(key)
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            signature = signer.sign(data)
+        assina = repeticoes / (time.perf_counter() - inicio)
+
+        verifier = Signer(importa_chave(exporta_publica(key)))
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            verifier.verify(data, signature)
+        verifica = repeticoes / (time.perf_counter() - inicio)
+        print(f"{esquema:<8} {chaves:>10,.0f} {assina:>10,.0f} {verifica:>10,.0f} {len(signature):>6} {len(signature.hex()):>5}")
+
+if __name__ == '__main__':
+    benchmark()
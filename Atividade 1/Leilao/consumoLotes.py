@@ -0,0 +1,148 @@
+# Consumo em lotes com ack manual e prefetch, para os consumidores pika (BlockingConnection).
+#
+# O broker so entrega `prefetch` mensagens sem ack por canal, entao a memoria do processo
+# fica limitada e uma queda nao perde o que estava em voo: o que nao teve ack volta para
+# a fila. As mensagens entregues numa rodada da conexao (ate max_batch) vao juntas para
+# on_batch(ch, [(method, properties, body), ...]) e sao confirmadas com um unico
+# basic_ack(multiple=True). Se a mensagem batch[i] falhar, on_batch levanta
+# FalhaNaMensagem(i, causa): as anteriores sao confirmadas, so batch[i] volta para a
+# fila (uma vez; numa segunda falha, ja reentregue, e descartada) e o resto do lote segue.
+# Qualquer outra excecao descarta o que sobrou do lote sem reenfileirar, para nao repetir
+# efeitos (publicacoes) de mensagens que ja tinham sido processadas.
+# por_mensagem/cada_mensagem montam on_batch que chamam um callback por mensagem.
+#
+# Uso:
+#     consumer = BatchConsumer(channel, on_batch, prefetch=100, max_batch=50)
+#     consumer.consume('fila')
+#     channel.start_consuming()
+#
+# Com o RabbitMQ rodando, python consumoLotes.py [MENSAGENS] compara auto_ack com
+# prefetch de 1 a 1000: mensagens/s e pico de memoria (RSS) do consumidor.
+
+PREFETCH = 100
+LOTE_MAX = 50
+
+class FalhaNaMensagem(Exception):
+    """Raised by on_batch when batch[index] failed; the messages before it were processed."""
+
+    def __init__(self, index, causa):
+        super().__init__(f"mensagem {index} do lote: {causa}")
+        self.index = index
+        self.causa = causa
+
+def cada_mensagem(callback):
+    """Builds an on_batch that calls callback(ch, method, properties, body) per message."""
+    def on_batch(ch, batch):
+        for index, (method, properties, body) in enumerate(batch):
+            try:
+                callback(ch, method, properties, body)
+            except Exception as e:
+                raise FalhaNaMensagem(index, e) from e
+    return on_batch
+
+def por_mensagem(callbacks):
+    """Like cada_mensagem, choosing the callback by routing key."""
+    return cada_mensagem(lambda ch, method, properties, body: callbacks[method.routing_key](ch, method, properties, body))
+
+class BatchConsumer:
+    def __init__(self, channel, on_batch, prefetch=PREFETCH, max_batch=LOTE_MAX):
+        self.channel = channel
+        self.on_batch = on_batch
+        self.max_batch = max_batch
+        self.pending = []
+        channel.basic_qos(prefetch_count=prefetch)
+
+    def consume(self, queue):
+        self.channel.basic_consume(queue=queue, on_message_callback=self._on_message)
+
+    def _on_message(self, ch, method, properties, body):
+        # o lote fecha no fim da rodada de entregas atual ou ao atingir max_batch
+        if not self.pending:
+            ch.connection.add_callback_threadsafe(self.flush)
+        self.pending.append((method, properties, body))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        restantes = self.pending
+        self.pending = []
+        # lotes anteriores do canal ja foram confirmados, entao multiple so cobre este
+        while restantes:
+            try:
+                self.on_batch(self.channel, restantes)
+            except FalhaNaMensagem as e:
+                if e.index > 0:
+                    self.channel.basic_ack(restantes[e.index - 1][0].delivery_tag, multiple=True)
+                method = restantes[e.index][0]
+                print(f"Erro ao processar mensagem de {method.routing_key}: {e.causa}")
+                self.channel.basic_nack(method.delivery_tag, requeue=not method.redelivered)
+                restantes = restantes[e.index + 1:]
+            except Exception as e:
+                print(f"Erro ao processar lote, descartando {len(restantes)} mensagens: {e}")
+                for method, _, _ in restantes:
+                    self.channel.basic_nack(method.delivery_tag, requeue=False)
+                return
+            else:
+                self.channel.basic_ack(restantes[-1][0].delivery_tag, multiple=True)
+                return
+
+def _mede(prefetch, mensagens, fila, resultado):
+    import resource
+    import time
+
+    import pika
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    recebidas = 0
+    inicio = time.perf_counter()
+
+    def conta(ch, method, properties, body):
+        nonlocal recebidas
+        recebidas += 1
+        if recebidas >= mensagens:
+            ch.stop_consuming()
+
+    if prefetch is None:
+        channel.basic_consume(queue=fila, on_message_callback=conta, auto_ack=True)
+    else:
+        consumer = BatchConsumer(channel, cada_mensagem(conta), prefetch, max_batch=min(LOTE_MAX, prefetch))
+        consumer.consume(fila)
+    channel.start_consuming()
+    if prefetch is not None:
+        consumer.flush()
+    taxa = mensagens / (time.perf_counter() - inicio)
+    connection.close()
+    resultado.put((taxa, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def benchmark(mensagens=100000, tamanho=256):
+    import multiprocessing
+
+    import pika
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    fila = 'benchmark_consumo_lotes'
+    body = bytes(tamanho)
+    print(f"{'modo':<16} {'msgs/s':>10} {'RSS MB':>8}  ({mensagens} mensagens de {tamanho} bytes)")
+    # cada medicao roda em um processo novo para o pico de RSS ser so dela
+    for prefetch in (None, 1, 10, 100, 1000):
+        channel.queue_declare(queue=fila, auto_delete=False)
+        channel.queue_purge(queue=fila)
+        for _ in range(mensagens):
+            channel.basic_publish(exchange='', routing_key=fila, body=body)
+        resultado = multiprocessing.Queue()
+        processo = multiprocessing.Process(target=_mede, args=(prefetch, mensagens, fila, resultado))
+        processo.start()
+        taxa, rss = resultado.get()
+        processo.join()
+        modo = 'auto_ack' if prefetch is None else f'prefetch {prefetch}'
+        print(f"{modo:<16} {taxa:>10,.0f} {rss:>8.1f}")
+    channel.queue_delete(queue=fila)
+    connection.close()
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*(int(arg) for arg in sys.argv[1:2]))
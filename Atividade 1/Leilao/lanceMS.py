@@ -1,8 +1,10 @@
 import pika
-import json
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
+import struct
+import functools
+from collections import deque
+import codecMensagens
+import consumoLotes
+import verificadorLances
 
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'leilao_exchange'
@@ -14,9 +16,38 @@ ROUTING_KEY_LANCE_REALIZADO = 'lance_realizado'
 ROUTING_KEY_LANCE_VALIDADO = 'lance_validado'
 ROUTING_KEY_LEILAO_VENCEDOR = 'leilao_vencedor'
 
+# formato das mensagens publicadas; consumidores decodificam pelo content_type
+FORMATO_MENSAGENS = codecMensagens.BINARIO
+
+def publica(ch, routing_key, json_data):
+    body, content_type = codecMensagens.encode(routing_key, json_data, FORMATO_MENSAGENS)
+    ch.basic_publish(
+        exchange=EXCHANGE_NAME,
+        routing_key=routing_key,
+        body=body,
+        properties=codecMensagens.propriedades(content_type)
+    )
+    return body
+
+# assinaturas sao verificadas em um pool de processos; a validacao do lance continua
+# so nesta thread, na ordem de chegada de cada leilao
+verificador = verificadorLances.SignatureVerifier()
+
+# lances a caminho do pool, juntados enquanto o pika entrega a rodada atual de mensagens
+lote = []
+# lei_id -> deque de (future do lote, posicao no lote, delivery_tag, lance), em ordem de chegada
+em_verificacao = {}
+
 # chave eh o id do leilao
 ultimos_lances_validos = {}
 
+# raias de consumo, cada uma com canal e prefetch proprios e ack manual. Um lance so e
+# confirmado depois de verificado e validado, entao PREFETCH_LANCES limita os lances em
+# verificacao e precisa ser grande o bastante para manter todos os processos ocupados
+PREFETCH_CONTROLE = 10
+LOTE_CONTROLE = 10
+PREFETCH_LANCES = verificadorLances.WORKERS * verificadorLances.LOTE_MAX * 2
+
 # Routing keys
 QUEUE_BINDINGS = [
     (ROUTING_KEY_LANCE_REALIZADO, ROUTING_KEY_LANCE_REALIZADO),
@@ -25,20 +56,63 @@ QUEUE_BINDINGS = [
 ]
 
 def process_lance_realizado(ch, method, properties, body):
-    json_data_signed = json.loads(body)
-    print(f"Lance recebido: {json_data_signed['message']}")
-    json_data = json.loads(json_data_signed['message'])
-    signature = json_data_signed['signature']
+    # lance e assinatura chegam juntos, sem JSON dentro de JSON
+    json_data = codecMensagens.decode_mensagem(properties, body)
+    print(f"Lance recebido: {json_data}")
 
-    # verifica assinatura, se nao for valida ignora
+    # prepara a forma canonica do lance, que e o que a assinatura cobre
     try:
-        key = RSA.import_key(open(f"../Cliente/public_key_{json_data['cli_id']}.pem").read())
-        h = SHA256.new(json_data_signed['message'].encode())
-        pkcs1_15.new(key).verify(h, bytes.fromhex(signature))
-    except (ValueError, TypeError):
-        print("Assinatura inválida")
+        signature = json_data.pop('signature')
+        assinados = codecMensagens.bytes_assinados(json_data)
+        signature = bytes.fromhex(signature) if isinstance(signature, str) else signature
+    except (ValueError, TypeError, KeyError, struct.error):
+        print("Lance malformado")
+        ch.basic_ack(method.delivery_tag)
         return
-    
+
+    # a verificacao fica para o pool; o lote sai ao fim desta rodada de entregas
+    if not lote:
+        ch.connection.add_callback_threadsafe(functools.partial(envia_lote, ch))
+    lote.append((method.delivery_tag, json_data, (json_data['cli_id'], assinados, signature)))
+    if len(lote) >= verificadorLances.LOTE_MAX:
+        envia_lote(ch)
+
+def envia_lote(ch):
+    if not lote:
+        return
+    itens = lote[:]
+    lote.clear()
+    future = verificador.submit([item for _, _, item in itens])
+    lei_ids = set()
+    for posicao, (delivery_tag, json_data, _) in enumerate(itens):
+        em_verificacao.setdefault(json_data['lei_id'], deque()).append((future, posicao, delivery_tag, json_data))
+        lei_ids.add(json_data['lei_id'])
+    # o resultado volta pela thread da conexao, a unica que mexe nos leiloes e nos acks
+    future.add_done_callback(
+        lambda _: ch.connection.add_callback_threadsafe(functools.partial(drena, ch, lei_ids)))
+
+def drena(ch, lei_ids):
+    # valida, na ordem de chegada, os lances ja verificados do inicio da fila de cada leilao
+    for lei_id in lei_ids:
+        fila = em_verificacao.get(lei_id)
+        while fila and fila[0][0].done():
+            future, posicao, delivery_tag, json_data = fila.popleft()
+            try:
+                valida = future.result()[posicao]
+            except Exception as e:
+                # pool quebrado ou cancelado: devolve o lance para a fila
+                print(f"Erro ao verificar assinatura: {e}")
+                ch.basic_nack(delivery_tag, requeue=True)
+                continue
+            if valida:
+                valida_lance(ch, json_data)
+            else:
+                print("Assinatura inválida")
+            ch.basic_ack(delivery_tag)
+        if fila is not None and not fila:
+            del em_verificacao[lei_id]
+
+def valida_lance(ch, json_data):
     # se leilao nao existe, ou esta finalizado, ignora
     if json_data['lei_id'] not in ultimos_lances_validos or ultimos_lances_validos[json_data['lei_id']]['status'] == 'finalizado':
         print(f"Leilão não existe ou está finalizado: {json_data['lei_id']}")
@@ -50,11 +124,7 @@ def process_lance_realizado(ch, method, properties, body):
         ultimos_lances_validos[json_data['lei_id']]['lance'] = json_data['lance']
         ultimos_lances_validos[json_data['lei_id']]['cli_id'] = json_data['cli_id']
         # publica o lance validado
-        ch.basic_publish(
-            exchange=EXCHANGE_NAME,
-            routing_key=ROUTING_KEY_LANCE_VALIDADO,
-            body=json.dumps(json_data)
-        )
+        publica(ch, ROUTING_KEY_LANCE_VALIDADO, json_data)
         print(f"Lance validado: {json_data}")
     
     # se nao, lance ignorado por ser menor
@@ -63,8 +133,12 @@ def process_lance_realizado(ch, method, properties, body):
         return
 
 def process_leilao_iniciado(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     print(f"Leilao iniciado: {json_data['lei_id']}")
+    # reentrega de um leilao ja conhecido nao zera os lances
+    if json_data['lei_id'] in ultimos_lances_validos:
+        print(f"Leilão já iniciado: {json_data['lei_id']}")
+        return
     # inicializa o leilão
     ultimos_lances_validos[json_data['lei_id']] = {
         'lance': 0,
@@ -75,21 +149,25 @@ def process_leilao_iniciado(ch, method, properties, body):
     print(ultimos_lances_validos[json_data['lei_id']])
 
 def process_leilao_finalizado(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     print(f"Leilao finalizado: {json_data['lei_id']}")
+    # leilao desconhecido ou ja finalizado (reentrega): nao anuncia vencedor de novo
+    if json_data['lei_id'] not in ultimos_lances_validos or ultimos_lances_validos[json_data['lei_id']]['status'] == 'finalizado':
+        print(f"Leilão não existe ou já foi finalizado: {json_data['lei_id']}")
+        return
     ultimos_lances_validos[json_data['lei_id']]['status'] = 'finalizado'
 
     json_data['cli_id'] = ultimos_lances_validos[json_data['lei_id']]['cli_id']
     json_data['lance'] = ultimos_lances_validos[json_data['lei_id']]['lance']
     json_data['desc'] = ultimos_lances_validos[json_data['lei_id']]['desc']
-    message = json.dumps(json_data)
+    publica(ch, ROUTING_KEY_LEILAO_VENCEDOR, json_data)
+    print(f"Leilão finalizado: {json_data}")
 
-    ch.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key=ROUTING_KEY_LEILAO_VENCEDOR,
-        body=message
-    )
-    print(f"Leilão finalizado: {message}")
+# raia de controle: inicio/fim confirmados em lotes com um ack multiple
+CONTROLE = {
+    ROUTING_KEY_LEILAO_INICIADO: process_leilao_iniciado,
+    ROUTING_KEY_LEILAO_FINALIZADO: process_leilao_finalizado,
+}
 
 def main():
     # abre conexao e exchange para publicar mensagens
@@ -102,15 +180,24 @@ def main():
         channel.queue_declare(queue=queue_name)
         channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
 
-    channel.basic_consume(queue='lance_realizado', on_message_callback=process_lance_realizado, auto_ack=True)
-    channel.basic_consume(queue='leilao_iniciado', on_message_callback=process_leilao_iniciado, auto_ack=True)
-    channel.basic_consume(queue='leilao_finalizado', on_message_callback=process_leilao_finalizado, auto_ack=True)
+    # um canal por raia: controle (inicio/fim) nao disputa prefetch com os lances
+    controle = consumoLotes.BatchConsumer(connection.channel(), consumoLotes.por_mensagem(CONTROLE),
+                                          PREFETCH_CONTROLE, LOTE_CONTROLE)
+    for queue_name in CONTROLE:
+        controle.consume(queue_name)
+    # lances confirmam a si mesmos quando saem do pool de verificacao
+    lances = connection.channel()
+    lances.basic_qos(prefetch_count=PREFETCH_LANCES)
+    lances.basic_consume(queue=ROUTING_KEY_LANCE_REALIZADO, on_message_callback=process_lance_realizado)
 
     print("Esperando mensagens de leilao ou lances...")
     try:
-        channel.start_consuming()
+        while True:
+            connection.process_data_events(time_limit=None)
     except (KeyboardInterrupt, EOFError):
-        channel.stop_consuming()
+        pass
+    # lances ainda sem ack voltam para a fila quando a conexao fecha
+    verificador.shutdown(wait=False)
     connection.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+# Mede quanto um leilao_finalizado demora para virar leilao_vencedor enquanto o lanceMS
+# esta saturado de lances.
+#
+# Com o RabbitMQ e o lanceMS rodando (a partir desta pasta):
+#     python latenciaFinalizacao.py [LANCES]
+# Abre um leilao de teste, despeja LANCES lances assinados em lance_realizado, publica o
+# leilao_finalizado no meio da enxurrada e cronometra ate o leilao_vencedor chegar.
+# Cada execucao usa um lei_id novo (derivado do relogio), entao o dedup do lanceMS nao
+# ignora o leilao de uma execucao anterior, e apaga a chave publica de teste no fim.
+
+import os
+import sys
+import time
+
+import pika
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15
+
+import codecMensagens
+
+RABBITMQ_HOST = 'localhost'
+EXCHANGE_NAME = 'leilao_exchange'
+CLI_ID = 9999
+ESPERA_VENCEDOR = 60  # segundos sem leilao_vencedor antes de desistir
+
+def main():
+    lances = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    key_path = f"../Cliente/public_key_{CLI_ID}.pem"
+
+    key = RSA.generate(2048)
+    with open(key_path, "wb") as f:
+        f.write(key.publickey().export_key())
+    try:
+        mede(lances, key, int(time.time() * 1000))
+    finally:
+        os.remove(key_path)
+
+def mede(lances, key, lei_id):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
+    channel = connection.channel()
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct')
+    vencedor = channel.queue_declare(queue='', exclusive=True).method.queue
+    channel.queue_bind(exchange=EXCHANGE_NAME, queue=vencedor, routing_key='leilao_vencedor')
+
+    def publica(routing_key, data, formato=codecMensagens.JSON):
+        body, content_type = codecMensagens.encode(routing_key, data, formato)
+        channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key, body=body,
+                              properties=codecMensagens.propriedades(content_type))
+
+    publica('leilao_iniciado', {'lei_id': lei_id, 'desc': 'teste de latencia', 'data_inic': 0, 'data_fim': 0})
+
+    # lances crescentes, assinados de antemao para o custo ficar todo no lanceMS
+    assinados = []
+    for lance in range(1, lances + 1):
+        data = {'lei_id': lei_id, 'cli_id': CLI_ID, 'lance': lance}
+        data['signature'] = pkcs1_15.new(key).sign(SHA256.new(codecMensagens.bytes_assinados(data)))
+        assinados.append(data)
+    for data in assinados:
+        publica('lance_realizado', data, codecMensagens.BINARIO)
+
+    inicio = time.monotonic()
+    publica('leilao_finalizado', {'lei_id': lei_id, 'desc': 'teste de latencia', 'data_inic': 0, 'data_fim': 0})
+    for method, properties, body in channel.consume(vencedor, auto_ack=True, inactivity_timeout=ESPERA_VENCEDOR):
+        if method is None:
+            print(f"Nenhum leilao_vencedor em {ESPERA_VENCEDOR}s; o lanceMS esta rodando?")
+            channel.cancel()
+            connection.close()
+            return
+        data = codecMensagens.decode_mensagem(properties, body)
+        if data['lei_id'] == lei_id:
+            break
+    latencia = time.monotonic() - inicio
+    fila = channel.queue_declare(queue='lance_realizado', passive=True).method.message_count
+    print(f"leilao_vencedor {latencia * 1000:.1f} ms depois do leilao_finalizado")
+    print(f"lance vencedor {data['lance']} de {lances}; {fila} lances ainda na fila")
+    channel.cancel()
+    connection.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import pika
-import json
+import codecMensagens
 import schedule
 import time
 
@@ -34,7 +34,7 @@ def leilao_agendado(evento, lei_id, channel):
     elif evento == FINALIZAR:
         routing_key = ROUTING_KEY_LEILAO_FINALIZADO
         
-    message = json.dumps({
+    message, content_type = codecMensagens.encode(routing_key, {
         'lei_id': leiloes[lei_id]['lei_id'],
         'desc': leiloes[lei_id]['desc'],
         'data_inic': leiloes[lei_id]['data_inic'],
@@ -43,7 +43,8 @@ def leilao_agendado(evento, lei_id, channel):
     channel.basic_publish(
        exchange=EXCHANGE_NAME,
        routing_key=routing_key,
-       body=message
+       body=message,
+       properties=codecMensagens.propriedades(content_type)
     )
     if evento == INICIAR:
         print(f"Leilão iniciado: {lei_id}")
@@ -1,5 +1,7 @@
 import pika
-import json
+import functools
+import codecMensagens
+import consumoLotes
 
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'leilao_exchange'
@@ -7,25 +9,62 @@ QUEUE_LANCE_VALIDADO = 'lance_validado'
 QUEUE_LEILAO_VENCEDOR = 'leilao_vencedor'
 ROUTING_KEY_LEILAO_PART = 'leilao_'
 
-def on_message(ch, method, properties, body):
-    print(f"Recebido de {method.routing_key}: {body.decode()}")
-    json_data = json.loads(body)
+# formato das notificacoes para os clientes; lances usam o layout binario 'leilao_lance'
+FORMATO_MENSAGENS = codecMensagens.BINARIO
+
+# ack manual: no maximo PREFETCH mensagens em voo, confirmadas em lotes de ate LOTE_MAX
+PREFETCH = 200
+LOTE_MAX = 100
+
+# lances de um mesmo leilao sao conflacionados: o mais novo fica retido por JANELA_LANCES
+# segundos e so ele e publicado, entao numa disputa os clientes recebem no maximo um
+# preco por janela em vez de cada lance intermediario. 0 publica todo lance na hora.
+# leilao_vencedor nunca e retido: sai na hora, depois do lance pendente do leilao.
+JANELA_LANCES = 0.05
+
+# lei_id -> ultimo lance validado ainda nao publicado
+lances_retidos = {}
+
+def publica(ch, evento, json_data):
     routing_key = ROUTING_KEY_LEILAO_PART + str(json_data['lei_id'])
+    message, content_type = codecMensagens.encode(evento, json_data, FORMATO_MENSAGENS)
+    ch.basic_publish(
+        exchange=EXCHANGE_NAME,
+        routing_key=routing_key,
+        body=message,
+        properties=codecMensagens.propriedades(content_type)
+    )
+    print(f"Mensagem publicada em {routing_key}: {json_data}")
+
+def publica_retido(ch, lei_id):
+    json_data = lances_retidos.pop(lei_id, None)
+    if json_data is not None:
+        publica(ch, 'leilao_lance', json_data)
+
+def on_message(ch, method, properties, body):
+    json_data = codecMensagens.decode_mensagem(properties, body)
+    print(f"Recebido de {method.routing_key}: {json_data}")
+    lei_id = json_data['lei_id']
 
-    # se vier de lances repassa o lance
+    # se vier de lances repassa o lance, so o mais novo de cada janela
     if method.routing_key == QUEUE_LANCE_VALIDADO:
         json_data['evento'] = 'lance'
+        if JANELA_LANCES <= 0:
+            publica(ch, 'leilao_lance', json_data)
+            return
+        if lei_id not in lances_retidos:
+            ch.connection.call_later(JANELA_LANCES, functools.partial(publica_retido, ch, lei_id))
+        lances_retidos[lei_id] = json_data
     # se nao, eh leilao finalizado 
     elif method.routing_key == QUEUE_LEILAO_VENCEDOR:
         json_data['evento'] = 'fim'
+        # o ultimo lance retido sai antes do fim, para os clientes nao o verem depois
+        publica_retido(ch, lei_id)
+        publica(ch, 'leilao_fim', json_data)
 
-    message = json.dumps(json_data)
-    ch.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key=routing_key,
-        body=message
-    )
-    print(f"Mensagem publicada em {routing_key}: {message}")
+# as notificacoes vao para a fila de cada leilao; o lote economiza os acks (um
+# basic_ack multiple por lote) e os lances sao conflacionados em on_message
+on_batch = consumoLotes.cada_mensagem(on_message)
 
 def main():
     # abre conexao e exchange para publicar mensagens
@@ -40,8 +79,9 @@ def main():
     channel.queue_bind(exchange=EXCHANGE_NAME, queue=QUEUE_LANCE_VALIDADO, routing_key=QUEUE_LANCE_VALIDADO)
     channel.queue_bind(exchange=EXCHANGE_NAME, queue=QUEUE_LEILAO_VENCEDOR, routing_key=QUEUE_LEILAO_VENCEDOR)
 
-    channel.basic_consume(queue=QUEUE_LANCE_VALIDADO, on_message_callback=on_message, auto_ack=True)
-    channel.basic_consume(queue=QUEUE_LEILAO_VENCEDOR, on_message_callback=on_message, auto_ack=True)
+    consumer = consumoLotes.BatchConsumer(channel, on_batch, PREFETCH, LOTE_MAX)
+    consumer.consume(QUEUE_LANCE_VALIDADO)
+    consumer.consume(QUEUE_LEILAO_VENCEDOR)
 
     print("Esperando mensagens de lance_validado e leilao_vencedor...")
     try:
@@ -51,4 +91,8 @@ def main():
     connection.close()
 
 if __name__ == '__main__':
+    import sys
+    # argumento opcional: janela de conflacao dos lances em ms (0 desliga)
+    if len(sys.argv) > 1:
+        JANELA_LANCES = float(sys.argv[1]) / 1000
     main()
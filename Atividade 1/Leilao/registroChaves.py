@@ -0,0 +1,134 @@
+# Registro das chaves publicas dos clientes, usado pelo lanceMS para verificar lances.
+#
+# Cada ../Cliente/public_key_{cli_id}.pem e lido e convertido (PEM/ASN.1 -> chave) uma
+# unica vez; o verificador pronto (assinaturas.Signer, do esquema que a chave indicar)
+# fica em um LRU limitado a MAX_KEYS clientes.
+# Para pegar chaves novas ou trocadas sem reiniciar, o mtime do arquivo e conferido no
+# maximo a cada CHECK_INTERVAL segundos por cliente; se mudou, a chave e relida.
+#
+# Uso:
+#     chaves = KeyRegistry('../Cliente')
+#     if chaves.verify(cli_id, bytes_assinados, assinatura): ...
+#
+# python registroChaves.py [BIDDERS] [LANCES] compara lances/s lendo a chave do disco a
+# cada lance (como antes) e usando o registro.
+
+import os
+import time
+from collections import OrderedDict
+
+import assinaturas
+
+KEY_DIR = '../Cliente'
+MAX_KEYS = 16384
+CHECK_INTERVAL = 1.0  # segundos
+
+class KeyRegistry:
+    def __init__(self, key_dir=KEY_DIR, max_keys=MAX_KEYS, check_interval=CHECK_INTERVAL):
+        self.key_dir = key_dir
+        self.max_keys = max_keys
+        self.check_interval = check_interval
+        # cli_id -> [verificador, mtime do arquivo, ultima conferencia do mtime]
+        self.entries = OrderedDict()
+
+    def path(self, cli_id):
+        return os.path.join(self.key_dir, f"public_key_{cli_id}.pem")
+
+    def _load(self, cli_id, mtime=None):
+        path = self.path(cli_id)
+        with open(path) as f:
+            key = assinaturas.importa_chave(f.read())
+        if mtime is None:
+            mtime = os.stat(path).st_mtime_ns
+        entry = [assinaturas.Signer(key), mtime, time.monotonic()]
+        self.entries[cli_id] = entry
+        if len(self.entries) > self.max_keys:
+            self.entries.popitem(last=False)
+        return entry
+
+    def verifier(self, cli_id):
+        """Returns the cached verifier for cli_id; raises OSError/ValueError for a missing or bad key."""
+        entry = self.entries.get(cli_id)
+        if entry is None:
+            return self._load(cli_id)[0]
+        self.entries.move_to_end(cli_id)
+        now = time.monotonic()
+        if now - entry[2] >= self.check_interval:
+            mtime = os.stat(self.path(cli_id)).st_mtime_ns
+            if mtime != entry[1]:
+                print(f"Chave do cliente {cli_id} mudou, recarregando")
+                return self._load(cli_id, mtime)[0]
+            entry[2] = now
+        return entry[0]
+
+    def verify(self, cli_id, data, signature):
+        try:
+            verifier = self.verifier(cli_id)
+        except (OSError, ValueError):
+            # arquivo ausente ou chave ilegivel: nada fica em cache
+            self.entries.pop(cli_id, None)
+            return False
+        if len(signature) != verifier.signature_size:
+            # assinatura de outro esquema: talvez o cliente trocou de chave, rele no proximo lance
+            self.entries.pop(cli_id, None)
+            return False
+        try:
+            verifier.verify(data, signature)
+            return True
+        except (ValueError, TypeError):
+            # assinatura invalida (forjada ou corrompida): a chave em cache continua valendo;
+            # rotacao de chave e detectada pelo mtime
+            return False
+
+    def forget(self, cli_id):
+        self.entries.pop(cli_id, None)
+
+def amostra_assinada(key_dir, bidders, lances, distinct_keys, esquema=assinaturas.RSA_2048):
+    """Writes bidders key files to key_dir and returns lances (cli_id, signed bytes, signature)."""
+    import random
+
+    import codecMensagens
+
+    # gerar 10k chaves RSA levaria minutos; os arquivos repetem poucas chaves, mas cada um
+    # e lido e convertido por conta propria, que e o custo medido
+    keys = [assinaturas.gera_chave(esquema) for _ in range(distinct_keys)]
+    for cli_id in range(bidders):
+        with open(os.path.join(key_dir, f"public_key_{cli_id}.pem"), "wb") as f:
+            f.write(assinaturas.exporta_publica(keys[cli_id % distinct_keys]))
+    assinadas = {}
+    amostra = []
+    for _ in range(lances):
+        data = {'lei_id': 1, 'cli_id': random.randrange(bidders), 'lance': 100}
+        signed = codecMensagens.bytes_assinados(data)
+        if data['cli_id'] not in assinadas:
+            key = keys[data['cli_id'] % distinct_keys]
+            assinadas[data['cli_id']] = assinaturas.Signer(key).sign(signed)
+        amostra.append((data['cli_id'], signed, assinadas[data['cli_id']]))
+    return amostra
+
+def benchmark(bidders=10000, lances=20000, distinct_keys=16):
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        amostra = amostra_assinada(key_dir, bidders, lances, distinct_keys)
+
+        inicio = time.perf_counter()
+        for cli_id, signed, signature in amostra:
+            with open(os.path.join(key_dir, f"public_key_{cli_id}.pem")) as f:
+                key = assinaturas.importa_chave(f.read())
+            assinaturas.Signer(key).verify(signed, signature)
+        antes = lances / (time.perf_counter() - inicio)
+        print(f"sem registro: {antes:,.0f} lances/s ({bidders} clientes, {lances} lances)")
+
+        registry = KeyRegistry(key_dir)
+        for aquecido in (False, True):
+            inicio = time.perf_counter()
+            for cli_id, signed, signature in amostra:
+                assert registry.verify(cli_id, signed, signature)
+            depois = lances / (time.perf_counter() - inicio)
+            rotulo = 'registro (cache quente)' if aquecido else 'registro (primeira passada)'
+            print(f"{rotulo}: {depois:,.0f} lances/s")
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
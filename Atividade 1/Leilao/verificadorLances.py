@@ -0,0 +1,84 @@
+# Verificacao das assinaturas dos lances em paralelo, fora do processo do lanceMS.
+#
+# A verificacao da assinatura e o custo dominante de um lance e, feita no callback do pika,
+# limita o lanceMS a um nucleo. Aqui ela roda em um pool de processos; cada processo tem
+# o proprio registroChaves.KeyRegistry, entao cada chave e convertida uma vez por processo.
+# Os lances vao em lotes: enviar um por vez ao pool custa mais em IPC que a propria
+# verificacao.
+#
+# Uso:
+#     verificador = SignatureVerifier()
+#     future = verificador.submit([(cli_id, bytes_assinados, assinatura), ...])
+#     future.result()  # [bool, ...] na mesma ordem
+#     verificador.shutdown()
+#
+# python verificadorLances.py [BIDDERS] [LANCES] [PROCESSOS] mede lances/s verificados em
+# linha e com 1, 2, 4, ... processos, ate PROCESSOS (padrao: numero de nucleos).
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import registroChaves
+
+WORKERS = os.cpu_count() or 1
+LOTE_MAX = 64  # lances por tarefa do pool
+
+# registro de chaves do processo do pool
+_chaves = None
+
+def _inicia(key_dir):
+    global _chaves
+    _chaves = registroChaves.KeyRegistry(key_dir)
+
+def _verifica(itens):
+    return [_chaves.verify(cli_id, data, signature) for cli_id, data, signature in itens]
+
+class SignatureVerifier:
+    def __init__(self, workers=WORKERS, key_dir=registroChaves.KEY_DIR):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_inicia, initargs=(key_dir,))
+
+    def submit(self, itens):
+        return self.pool.submit(_verifica, itens)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+def benchmark(bidders=10000, lances=20000, max_workers=WORKERS, distinct_keys=16):
+    import tempfile
+    import time
+    from concurrent.futures import wait
+
+    with tempfile.TemporaryDirectory() as key_dir:
+        amostra = registroChaves.amostra_assinada(key_dir, bidders, lances, distinct_keys)
+
+        # referencia: mesmo registro, verificado em linha como no callback antigo
+        registry = registroChaves.KeyRegistry(key_dir)
+        for cli_id, signed, signature in amostra:
+            registry.verify(cli_id, signed, signature)
+        inicio = time.perf_counter()
+        for cli_id, signed, signature in amostra:
+            assert registry.verify(cli_id, signed, signature)
+        base = lances / (time.perf_counter() - inicio)
+        print(f"em linha: {base:,.0f} lances/s ({bidders} clientes, {lances} lances, {WORKERS} nucleos)")
+
+        workers = 1
+        while True:
+            verificador = SignatureVerifier(workers, key_dir)
+            # primeira passada aquece o registro de cada processo; mede a segunda
+            for passada in range(2):
+                inicio = time.perf_counter()
+                futures = [verificador.submit(amostra[i:i + LOTE_MAX]) for i in range(0, lances, LOTE_MAX)]
+                wait(futures)
+                tempo = time.perf_counter() - inicio
+            assert all(all(future.result()) for future in futures)
+            verificador.shutdown()
+            taxa = lances / tempo
+            print(f"{workers} processos: {taxa:,.0f} lances/s ({taxa / base:.2f}x)")
+            if workers >= max_workers:
+                break
+            workers = min(workers * 2, max_workers)
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*(int(arg) for arg in sys.argv[1:4]))
@@ -1,4 +1,6 @@
 const BASE_URL = 'http://127.0.0.1:5000'; // ajuste se seu backend roda em outra porta
+// todas as chamadas ao gateway levam cli_id na URL para o modo com shards (APIGatewaySharded.py)
+// encaminhar a conexao ao processo dono do cliente
 const CLI_ID = Math.floor(Date.now() / 1000)*1000 + Math.floor(Math.random() * 1000); // id do cliente
 console.log('Client ID:', CLI_ID);
 const container = document.getElementById('header');
@@ -97,8 +99,9 @@ eventSource.addEventListener('status_pagamento', function(event) {
 });
 
 eventSource.onerror = function(error) {
+    // nao fecha a conexao: o EventSource reconecta sozinho enviando o Last-Event-ID
+    // e o gateway reenvia o que foi perdido
     console.error('Error:', error);
-    eventSource.close();
 };
 
 eventSource.onopen = function() {
@@ -137,7 +140,7 @@ async function criarLeilao() {
             data_fim: unixSecondsFromDatetimeLocal(dataFim)
         };
 
-        const res = await fetch(`${BASE_URL}/criar_leilao`, {
+        const res = await fetch(`${BASE_URL}/criar_leilao?cli_id=${CLI_ID}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -172,7 +175,7 @@ async function efetuarLance() {
 
         const payload = { lei_id: lei_id, lance: valor, cli_id: CLI_ID };
 
-        const res = await fetch(`${BASE_URL}/lance`, {
+        const res = await fetch(`${BASE_URL}/lance?cli_id=${CLI_ID}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -195,7 +198,7 @@ async function efetuarLance() {
 
 async function consultarLeiloes() {
     try {
-        const res = await fetch(`${BASE_URL}/consultar_leiloes`);
+        const res = await fetch(`${BASE_URL}/consultar_leiloes?cli_id=${CLI_ID}`);
         if (!res.ok) {
             alert('Erro ao consultar leilões.');
             return;
@@ -236,7 +239,7 @@ async function registrarInteresse() {
         const lei_id = parseInt(document.getElementById('interesseLeilaoId').value);
         if (isNaN(lei_id)) { alert('ID inválido'); return; }
         const payload = { lei_id: lei_id, cli_id: CLI_ID };
-        const res = await fetch(`${BASE_URL}/registrar_interesse`, {
+        const res = await fetch(`${BASE_URL}/registrar_interesse?cli_id=${CLI_ID}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -258,7 +261,7 @@ async function cancelarInteresse() {
         const lei_id = parseInt(document.getElementById('interesseLeilaoId').value);
         if (isNaN(lei_id)) { alert('ID inválido'); return; }
         const payload = { lei_id: lei_id, cli_id: CLI_ID };
-        const res = await fetch(`${BASE_URL}/cancelar_interesse`, {
+        const res = await fetch(`${BASE_URL}/cancelar_interesse?cli_id=${CLI_ID}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -2,10 +2,16 @@
 # explained on https://maxhalford.github.io/blog/flask-sse-no-deps/
 
 import pika
+import sys
 import json
-import queue
+import time
+import itertools
 import threading
 import requests
+import clienteHttp
+import anelHash
+import codecMensagens
+from collections import OrderedDict, deque, namedtuple
 
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
@@ -24,61 +30,322 @@ EXCHANGE_NAME = 'leilao_exchange'
 EXCHANGE_TYPE = 'direct'
 
 CRIAR_LEILAO_URL = 'http://127.0.0.1:5001/criar_leilao'
+CRIAR_LEILOES_URL = 'http://127.0.0.1:5001/criar_leiloes'
+# criacao em lote pode levar mais que uma requisicao comum
+BULK_READ_TIMEOUT = 60.0
 CONSULTAR_LEILOES_URL = 'http://127.0.0.1:5001/consultar_leiloes'
-LANCE_URL = 'http://127.0.0.1:5002/lance'
+
+# lances vao direto para o shard do lanceMS dono do leilao (anel de hash consistente)
+anel_lance = anelHash.load()
+
+def lance_url(leilao_id):
+    return f"{anel_lance.url(leilao_id)}/lance"
+
+def atualiza_anel_lance(resposta):
+    # um shard respondeu 409: adota a topologia dele se for mais nova. Devolve True se mudou
+    global anel_lance
+    novo = anelHash.HashRing(resposta['topologia'])
+    if novo.versao <= anel_lance.versao:
+        return False
+    anel_lance = novo
+    print(f"Topologia dos shards de lance atualizada para a versao {novo.versao}")
+    return True
 
 ROUTING_KEY_LANCE_INVALIDADO = 'lance_invalidado'
 ROUTING_KEY_LANCE_VALIDADO = 'lance_validado'
 ROUTING_KEY_LEILAO_VENCEDOR = 'leilao_vencedor'
 ROUTING_KEY_LINK_PAGAMENTO = 'link_pagamento'
 ROUTING_KEY_STATUS_PAGAMENTO = 'status_pagamento'
+ROUTING_KEY_LEILAO_INICIADO = 'leilao_iniciado'
+ROUTING_KEY_LEILAO_FINALIZADO = 'leilao_finalizado'
+ROUTING_KEY_LEILAO_CRIADO = 'leilao_criado'
+
+# filas proprias do gateway para nao competir com o lanceMS pelas mensagens de inicio/fim
+QUEUE_LEILAO_INICIADO = 'leilao_iniciado_gateway'
+QUEUE_LEILAO_FINALIZADO = 'leilao_finalizado_gateway'
+QUEUE_LEILAO_CRIADO = 'leilao_criado_gateway'
 
 QUEUE_BINDINGS = [
     (ROUTING_KEY_LANCE_INVALIDADO, ROUTING_KEY_LANCE_INVALIDADO),
     (ROUTING_KEY_LANCE_VALIDADO, ROUTING_KEY_LANCE_VALIDADO),
     (ROUTING_KEY_LEILAO_VENCEDOR, ROUTING_KEY_LEILAO_VENCEDOR),
     (ROUTING_KEY_LINK_PAGAMENTO, ROUTING_KEY_LINK_PAGAMENTO),
-    (ROUTING_KEY_STATUS_PAGAMENTO, ROUTING_KEY_STATUS_PAGAMENTO)
+    (ROUTING_KEY_STATUS_PAGAMENTO, ROUTING_KEY_STATUS_PAGAMENTO),
+    (QUEUE_LEILAO_INICIADO, ROUTING_KEY_LEILAO_INICIADO),
+    (QUEUE_LEILAO_FINALIZADO, ROUTING_KEY_LEILAO_FINALIZADO),
+    (QUEUE_LEILAO_CRIADO, ROUTING_KEY_LEILAO_CRIADO)
 ]
 
 announcers_per_client = {}
+# indice de interesses nos dois sentidos: cliente -> leiloes e leilao -> clientes
 clients_interests = {}
+leilao_subscribers = {}
+# rotas Flask alteram o indice enquanto o consumidor o percorre: tudo passa por este lock
+# e quem percorre recebe uma copia
+interests_lock = threading.Lock()
+
+def add_interest(client_id, leilao_id):
+    with interests_lock:
+        clients_interests.setdefault(client_id, set()).add(leilao_id)
+        leilao_subscribers.setdefault(leilao_id, set()).add(client_id)
+
+def remove_interest(client_id, leilao_id):
+    with interests_lock:
+        interests = clients_interests.get(client_id)
+        if interests is None or leilao_id not in interests:
+            return False
+        interests.discard(leilao_id)
+        if not interests:
+            del clients_interests[client_id]
+        subscribers = leilao_subscribers.get(leilao_id)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
+                del leilao_subscribers[leilao_id]
+        return True
+
+def subscribers_of(leilao_id):
+    with interests_lock:
+        return tuple(leilao_subscribers.get(leilao_id, ()))
+
+def interests_of(client_id):
+    with interests_lock:
+        return tuple(clients_interests.get(client_id, ()))
+
+def drop_leilao(leilao_id):
+    # retira o interesse de todos os clientes inscritos no leilao, sem varrer os demais clientes
+    with interests_lock:
+        for client_id in leilao_subscribers.pop(leilao_id, ()):
+            interests = clients_interests.get(client_id)
+            if interests is not None:
+                interests.discard(leilao_id)
+                if not interests:
+                    del clients_interests[client_id]
+
+# eventos que podem ser mesclados para ouvintes lentos: so o ultimo preco de cada leilao importa.
+# os demais (vencedor, link e status de pagamento, lance invalidado) nunca sao descartados
+COALESCED_EVENTS = {'lance_validado'}
+# acima disso o ouvinte e considerado morto e removido
+MAX_PENDING_EVENTS = 1000
+
+REPLAY_EVENTS_PER_LEILAO = 64
+REPLAY_EVENTS_PER_CLIENT = 32
+MAX_REPLAY_LEILOES = 10000
+MAX_REPLAY_CLIENTS = 100000
+
+SSEEvent = namedtuple('SSEEvent', ['id', 'event', 'lei_id', 'frame'])
+
+# ids crescentes mesmo entre reinicios do gateway, para o Last-Event-ID continuar valido
+event_ids = itertools.count(int(time.time() * 1000))
+
+class Listener:
+    """Pending events of one SSE connection, merging price updates of the same auction."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.pending = OrderedDict()
+        self.closed = False
+
+    def _push(self, event):
+        if event.event in COALESCED_EVENTS:
+            # substitui o preco anterior ainda nao enviado e vai para o fim da fila
+            key = (event.event, event.lei_id)
+            self.pending.pop(key, None)
+        else:
+            key = event.id
+        self.pending[key] = event
+        return len(self.pending) <= MAX_PENDING_EVENTS
+
+    def _notify(self):
+        self.ready.notify()
+
+    def put(self, event):
+        with self.lock:
+            alive = self._push(event)
+            self._notify()
+        return alive
+
+    def prime(self, events):
+        # junta os eventos de replay com os que ja chegaram ao vivo, sem repetir ids
+        with self.lock:
+            merged = {event.id: event for event in events}
+            merged.update((event.id, event) for event in self.pending.values())
+            self.pending.clear()
+            for event_id in sorted(merged):
+                self._push(merged[event_id])
+            if self.pending:
+                self._notify()
+
+    def close(self):
+        # ouvinte descartado por fila cheia: get devolve None e o stream termina, entao o
+        # EventSource reconecta e recupera o que perdeu pelo Last-Event-ID
+        with self.lock:
+            self.closed = True
+            self.pending.clear()
+            self._notify()
+
+    def get(self):
+        with self.ready:
+            while not self.pending and not self.closed:
+                self.ready.wait()  # blocks until a new message arrives
+            if self.closed:
+                return None
+            return self.pending.popitem(last=False)[1]
 
 class MessageAnnouncer:
-    def __init__(self):
+    def __init__(self, listener_class=Listener):
+        self.listener_class = listener_class
         self.listeners = []
+        # a thread do consumidor anuncia enquanto as de requisicao entram e saem
+        self.lock = threading.Lock()
 
     def listen(self):
-        self.listeners.append(queue.Queue(maxsize=5))
-        return self.listeners[-1]
-
-    def announce(self, msg):
-        # We go in reverse order because we might have to delete an element, which will shift the
-        # indices backward
-        for i in reversed(range(len(self.listeners))):
-            try:
-                self.listeners[i].put_nowait(msg)
-            except queue.Full:
-                del self.listeners[i]
-
-
-def format_sse(data: str, event=None) -> str:
+        listener = self.listener_class()
+        with self.lock:
+            self.listeners.append(listener)
+        return listener
+
+    def unlisten(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def announce(self, event):
+        with self.lock:
+            listeners = tuple(self.listeners)
+        for listener in listeners:
+            if not listener.put(event):
+                listener.close()
+                self.unlisten(listener)
+
+class EventHistory:
+    """Bounded ring buffers of recent events, one per key (auction or client)."""
+    def __init__(self, maxlen, max_keys):
+        self.maxlen = maxlen
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.buffers = OrderedDict()
+
+    def record(self, key, event):
+        with self.lock:
+            if key not in self.buffers:
+                self.buffers[key] = deque(maxlen=self.maxlen)
+                if len(self.buffers) > self.max_keys:
+                    self.buffers.popitem(last=False)
+            else:
+                self.buffers.move_to_end(key)
+            self.buffers[key].append(event)
+
+    def since(self, key, last_event_id):
+        with self.lock:
+            return [event for event in self.buffers.get(key, ()) if event.id > last_event_id]
+
+    def discard(self, key):
+        with self.lock:
+            self.buffers.pop(key, None)
+
+leilao_history = EventHistory(REPLAY_EVENTS_PER_LEILAO, MAX_REPLAY_LEILOES)
+client_history = EventHistory(REPLAY_EVENTS_PER_CLIENT, MAX_REPLAY_CLIENTS)
+
+CATALOG_FIELDS = ('lei_id', 'nome', 'desc', 'lance_inic', 'data_inic', 'data_fim')
+# ordem dos estados, para eventos fora de ordem nao voltarem um leilao para tras
+STATUS_ORDER = {'agendado': 0, 'em andamento': 1, 'finalizado': 2}
+
+class AuctionCatalogCache:
+    """Materialized copy of leilaoMS' catalog, kept current by broker events."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leiloes = {}
+        self.loaded = False
+        self.version = 0
+        self.boot = int(time.time())
+        self.snapshot_cache = None
+
+    def upsert(self, leilao, status):
+        with self.lock:
+            atual = self.leiloes.get(leilao['lei_id'])
+            if atual is not None and STATUS_ORDER[atual['status']] > STATUS_ORDER[status]:
+                return
+            entry = {field: leilao[field] for field in CATALOG_FIELDS}
+            entry['status'] = status
+            if entry == atual:
+                return
+            self.leiloes[leilao['lei_id']] = entry
+            self.version += 1
+            self.snapshot_cache = None
+
+    def load(self, leiloes):
+        # carga inicial vinda do leilaoMS; entradas ja atualizadas por eventos prevalecem
+        for leilao in leiloes:
+            self.upsert(leilao, leilao['status'])
+        with self.lock:
+            self.loaded = True
+
+    def snapshot(self):
+        # corpo JSON serializado uma vez por versao do catalogo
+        with self.lock:
+            if self.snapshot_cache is None:
+                body = json.dumps([self.leiloes[lei_id] for lei_id in sorted(self.leiloes)]).encode()
+                self.snapshot_cache = (f"{self.boot}-{self.version}", body)
+            return self.snapshot_cache
+
+catalogo = AuctionCatalogCache()
+
+def ensure_catalog_loaded():
+    if catalogo.loaded:
+        return
+    response = clienteHttp.get(CONSULTAR_LEILOES_URL)
+    response.raise_for_status()
+    catalogo.load(response.json())
+
+
+def format_sse(data: str, event=None, id=None) -> str:
     """Formats a string and an event name in order to follow the event stream convention.
 
     >>> format_sse(data=json.dumps({'abc': 123}), event='Jackson 5')
     'event: Jackson 5\\ndata: {"abc": 123}\\n\\n'
+    >>> format_sse(data='pong', id=7)
+    'id: 7\\ndata: pong\\n\\n'
 
     """
     msg = f'data: {data}\n\n'
     if event is not None:
         msg = f'event: {event}\n{msg}'
+    if id is not None:
+        msg = f'id: {id}\n{msg}'
     return msg
 
+def encode_sse(data: str, event=None, id=None) -> bytes:
+    """Builds the event stream frame once, already encoded, so the same immutable buffer
+    can be handed to every listener queue.
+
+    >>> encode_sse(data='pong')
+    b'data: pong\\n\\n'
+
+    """
+    return format_sse(data=data, event=event, id=id).encode()
+
+def new_event(data: str, event=None, lei_id=None) -> SSEEvent:
+    event_id = next(event_ids)
+    return SSEEvent(event_id, event, lei_id, encode_sse(data=data, event=event, id=event_id))
+
+def replay_events(client_id, last_event_id):
+    # eventos direcionados ao cliente e eventos recentes dos leiloes que ele acompanha
+    events = client_history.since(client_id, last_event_id)
+    for leilao_id in interests_of(client_id):
+        events.extend(leilao_history.since(leilao_id, last_event_id))
+    return events
+
+def announce_to_client(client_id, event):
+    client_history.record(client_id, event)
+    if client_id in announcers_per_client:
+        announcers_per_client[client_id].announce(event=event)
+
 @app.get('/ping')
 def ping():
-    msg = format_sse(data='pong')
-    for announcer in announcers_per_client.values():
-        announcer.announce(msg=msg)
+    event = new_event(data='pong')
+    for announcer in list(announcers_per_client.values()):
+        announcer.announce(event=event)
     return {}, 200
 
 @app.get('/listen')
@@ -86,32 +353,82 @@ def listen():
     client_id = int(request.args.get('cli_id'))
     if client_id not in announcers_per_client:
         announcers_per_client[client_id] = MessageAnnouncer()
+    announcer = announcers_per_client[client_id]
+    listener = announcer.listen()
+
+    # EventSource reenvia o id do ultimo evento recebido ao reconectar
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    if last_event_id is not None and last_event_id.isdigit():
+        listener.prime(replay_events(client_id, int(last_event_id)))
+
     def stream():
-        messages = announcers_per_client[client_id].listen()  # returns a queue.Queue
-        while True:
-            msg = messages.get()  # blocks until a new message arrives
-            yield msg
+        # o Werkzeug fecha o gerador quando a conexao cai: o ouvinte sai do announcer na hora,
+        # sem acumular eventos ate MAX_PENDING_EVENTS
+        try:
+            while True:
+                event = listener.get()
+                if event is None:
+                    return
+                yield event.frame  # frame ja codificado em bytes, compartilhado entre ouvintes
+        finally:
+            announcer.unlisten(listener)
 
     print(f"Cliente {client_id} conectado para notificacoes SSE {announcers_per_client}")
     return Response(stream(), mimetype='text/event-stream')
 
 @app.delete('/unlisten')
 def unlisten():
-    client_id = request.args.get('cli_id')
+    client_id = int(request.args.get('cli_id'))
     if client_id in announcers_per_client:
         del announcers_per_client[client_id]
+    client_history.discard(client_id)
     return {"message": "Interrompendo notificacoes"}, 200
 
 @app.post('/criar_leilao')
 def criar_leilao():
     json_data = request.get_json()
-    response = requests.post(CRIAR_LEILAO_URL, json=json_data)
+    try:
+        response = clienteHttp.post(CRIAR_LEILAO_URL, json=json_data)
+    except requests.RequestException as e:
+        print(f"Erro ao contatar servico de leiloes: {e}")
+        return {"error": "Servico de leiloes indisponivel"}, 503
+    if response.status_code == 201:
+        # os demais gateways/shards atualizam pelo evento leilao_criado
+        catalogo.upsert(response.json(), 'agendado')
+    return jsonify(response.json()), response.status_code
+
+@app.post('/criar_leiloes')
+def criar_leiloes():
+    # repassa o corpo sem reinterpretar (array JSON ou NDJSON)
+    try:
+        response = clienteHttp.post(
+            CRIAR_LEILOES_URL,
+            data=request.get_data(),
+            headers={'Content-Type': request.content_type or 'application/json'},
+            timeout=(clienteHttp.CONNECT_TIMEOUT, BULK_READ_TIMEOUT),
+        )
+    except requests.RequestException as e:
+        print(f"Erro ao contatar servico de leiloes: {e}")
+        return {"error": "Servico de leiloes indisponivel"}, 503
+    if response.status_code == 200:
+        for resultado in response.json():
+            if resultado['status'] == 201:
+                catalogo.upsert(resultado['leilao'], 'agendado')
     return jsonify(response.json()), response.status_code
 
 @app.get('/consultar_leiloes')
 def consultar_leiloes():
-    response = requests.get(CONSULTAR_LEILOES_URL)
-    return jsonify(response.json()), response.status_code
+    # servido da copia em memoria, sem ir ao leilaoMS; 304 se o navegador ja tem a versao atual
+    try:
+        ensure_catalog_loaded()
+    except requests.RequestException as e:
+        print(f"Erro ao contatar servico de leiloes: {e}")
+        return {"error": "Servico de leiloes indisponivel"}, 503
+    etag, body = catalogo.snapshot()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.post('/lance')
 def lance():
@@ -120,12 +437,16 @@ def lance():
     # registra interesse do cliente no leilao
     client_id = json_data.get('cli_id')
     leilao_id = json_data.get('lei_id')
-    if client_id not in clients_interests:
-        clients_interests[client_id] = set()
-    clients_interests[client_id].add(leilao_id)
+    add_interest(client_id, leilao_id)
 
-    # envia o lance para o microservico de lances
-    response = requests.post(LANCE_URL, json=json_data)
+    # envia o lance para o shard dono do leilao; se a topologia mudou, reenvia uma vez
+    try:
+        response = clienteHttp.post(lance_url(leilao_id), json=json_data)
+        if response.status_code == 409 and atualiza_anel_lance(response.json()):
+            response = clienteHttp.post(lance_url(leilao_id), json=json_data)
+    except requests.RequestException as e:
+        print(f"Erro ao contatar servico de lances: {e}")
+        return {"error": "Servico de lances indisponivel"}, 503
     return jsonify(response.json()), response.status_code
 
 @app.post('/registrar_interesse')
@@ -134,10 +455,7 @@ def registrar_interesse():
     client_id = json_data.get('cli_id')
     leilao_id = json_data.get('lei_id')
 
-    if client_id not in clients_interests:
-        clients_interests[client_id] = set()
-
-    clients_interests[client_id].add(leilao_id)
+    add_interest(client_id, leilao_id)
     return {"message": "Interesse registrado com sucesso"}, 201
 
 @app.post('/cancelar_interesse')
@@ -146,41 +464,40 @@ def cancelar_interesse():
     client_id = json_data.get('cli_id')
     leilao_id = json_data.get('lei_id')
 
-    if client_id not in clients_interests:
+    if not remove_interest(client_id, leilao_id):
         return {"message": "Interesse não encontrado"}, 404
 
-    clients_interests[client_id].remove(leilao_id)
     return {"message": "Interesse cancelado com sucesso"}, 200
 
 
 def process_lance_invalidado(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     body = json.dumps({
         'lei_id': json_data['lei_id'],
         'cli_id': json_data['cli_id'],
         'lance': json_data['lance'],
     })
-    announcers_per_client[json_data['cli_id']].announce(msg=format_sse(data=body, event='lance_invalidado'))
+    announce_to_client(json_data['cli_id'], new_event(data=body, event='lance_invalidado', lei_id=json_data['lei_id']))
     print(f"Lance invalidado anunciado via SSE: {body}")
 
 def process_lance_validado(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     body = json.dumps({
         'lei_id': json_data['lei_id'],
         'cli_id': json_data['cli_id'],
         'lance': json_data['lance'],
     })
 
-    # anuncia para todos os clientes interessados
-    for client_id, interests in clients_interests.items():
-        if json_data['lei_id'] in interests:
-            print(str(clients_interests) + " --- " + str(client_id) + " --- " + str(announcers_per_client))
-            if client_id in announcers_per_client:
-                announcers_per_client[client_id].announce(msg=format_sse(data=body, event='lance_validado'))
+    # monta o frame uma unica vez e anuncia para todos os clientes interessados
+    event = new_event(data=body, event='lance_validado', lei_id=json_data['lei_id'])
+    leilao_history.record(json_data['lei_id'], event)
+    for client_id in subscribers_of(json_data['lei_id']):
+        if client_id in announcers_per_client:
+            announcers_per_client[client_id].announce(event=event)
     print(f"Lance validado anunciado via SSE: {body}")
 
 def process_leilao_vencedor(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     body = json.dumps({
         'lei_id': json_data['lei_id'],
         'cli_id': json_data['cli_id'],
@@ -189,21 +506,20 @@ def process_leilao_vencedor(ch, method, properties, body):
         'nome': json_data['nome']
     })
 
-    # anuncia para todos os clientes interessados
-    for client_id, interests in clients_interests.items():
-        if json_data['lei_id'] in interests:
-            if client_id in announcers_per_client:
-                announcers_per_client[client_id].announce(msg=format_sse(data=body, event='leilao_vencedor'))
+    # monta o frame uma unica vez e anuncia para todos os clientes interessados.
+    # o vencedor tambem vai para o historico de cada cliente, pois o interesse e removido abaixo
+    event = new_event(data=body, event='leilao_vencedor', lei_id=json_data['lei_id'])
+    leilao_history.record(json_data['lei_id'], event)
+    for client_id in subscribers_of(json_data['lei_id']):
+        announce_to_client(client_id, event)
 
     # retira interesse dos clientes pelo leilao finalizado
-    for client_id in clients_interests:
-        if json_data['lei_id'] in clients_interests[client_id]:
-            clients_interests[client_id].remove(json_data['lei_id'])
+    drop_leilao(json_data['lei_id'])
 
     print(f"Leilao vencedor anunciado via SSE: {body}")
 
 def process_link_pagamento(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     print(json_data)
     body = json.dumps({
         'lei_id': json_data['lei_id'],
@@ -211,19 +527,60 @@ def process_link_pagamento(ch, method, properties, body):
         'link_pagamento': json_data['link_pagamento']
     })
 
-    announcers_per_client[json_data['cli_id']].announce(msg=format_sse(data=body, event='link_pagamento'))
+    announce_to_client(json_data['cli_id'], new_event(data=body, event='link_pagamento', lei_id=json_data['lei_id']))
     print(f"Link de pagamento anunciado via SSE: {body}")
 
 def process_status_pagamento(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
     body = json.dumps({
         'lei_id': json_data['lei_id'],
         'cli_id': json_data['cli_id'],
         'status': json_data['status']
     })
-    announcers_per_client[json_data['cli_id']].announce(msg=format_sse(data=body, event='status_pagamento'))
+    announce_to_client(json_data['cli_id'], new_event(data=body, event='status_pagamento', lei_id=json_data['lei_id']))
     print(f"Status do pagamento anunciado via SSE: {body}")
 
+def process_leilao_criado(ch, method, properties, body):
+    # leilao criado por qualquer gateway (ou shard): todos os caches passam a lista-lo
+    catalogo.upsert(codecMensagens.decode_mensagem(properties, body), 'agendado')
+
+def process_leilao_iniciado(ch, method, properties, body):
+    catalogo.upsert(codecMensagens.decode_mensagem(properties, body), 'em andamento')
+
+def process_leilao_finalizado(ch, method, properties, body):
+    catalogo.upsert(codecMensagens.decode_mensagem(properties, body), 'finalizado')
+
+# raias de consumo: eventos de controle e terminais (vencedor, pagamento, inicio/fim) tem
+# canal e prefetch proprios, separados dos lances. Com ack manual o broker so entrega
+# PREFETCH_LANCES lances por vez, entao um leilao_vencedor espera no maximo esse tanto de
+# lances ja entregues, e nao todo o acumulado de uma enxurrada de lances
+PREFETCH_CONTROLE = 50
+PREFETCH_LANCES = 100
+LANES = {
+    'controle': PREFETCH_CONTROLE,
+    'lances': PREFETCH_LANCES,
+}
+# fila -> (raia, callback)
+QUEUE_LANES = {
+    'lance_invalidado': ('lances', process_lance_invalidado),
+    'lance_validado': ('lances', process_lance_validado),
+    'leilao_vencedor': ('controle', process_leilao_vencedor),
+    'link_pagamento': ('controle', process_link_pagamento),
+    'status_pagamento': ('controle', process_status_pagamento),
+    QUEUE_LEILAO_INICIADO: ('controle', process_leilao_iniciado),
+    QUEUE_LEILAO_FINALIZADO: ('controle', process_leilao_finalizado),
+    QUEUE_LEILAO_CRIADO: ('controle', process_leilao_criado),
+}
+
+def com_ack(callback):
+    # confirma a mensagem depois de processada, qualquer que seja o desfecho
+    def on_message(ch, method, properties, body):
+        try:
+            callback(ch, method, properties, body)
+        finally:
+            ch.basic_ack(method.delivery_tag)
+    return on_message
+
 def main():
     # abre conexao e exchange para publicar mensagens
     connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
@@ -235,18 +592,57 @@ def main():
         channel.queue_declare(queue=queue_name)
         channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
 
-    channel.basic_consume(queue='lance_invalidado', on_message_callback=process_lance_invalidado, auto_ack=True)
-    channel.basic_consume(queue='lance_validado', on_message_callback=process_lance_validado, auto_ack=True)
-    channel.basic_consume(queue='leilao_vencedor', on_message_callback=process_leilao_vencedor, auto_ack=True)
-    channel.basic_consume(queue='link_pagamento', on_message_callback=process_link_pagamento, auto_ack=True)
-    channel.basic_consume(queue='status_pagamento', on_message_callback=process_status_pagamento, auto_ack=True)
+    # um canal por raia, cada um com seu prefetch
+    lanes = {}
+    for lane, prefetch in LANES.items():
+        lanes[lane] = connection.channel()
+        lanes[lane].basic_qos(prefetch_count=prefetch)
+    for queue_name, (lane, callback) in QUEUE_LANES.items():
+        lanes[lane].basic_consume(queue=queue_name, on_message_callback=com_ack(callback))
 
     threading.Thread(target=runFlaskApp, daemon=True).start()
     try:
-        channel.start_consuming()
+        while True:
+            connection.process_data_events(time_limit=None)
     except (KeyboardInterrupt, EOFError):
-        channel.stop_consuming()
+        pass
     connection.close()
 
+def benchmark(eventos=1000):
+    # saldo de blocos alocados em APIGateway.py por lance_validado, com 10 a 10000 inscritos no
+    # leilao: com o frame compartilhado, nao cresce com o numero de inscritos
+    import contextlib
+    import io
+    import tracemalloc
+
+    body, content_type = codecMensagens.encode('lance_validado', {'lei_id': 1, 'cli_id': 1, 'lance': 100})
+    properties = codecMensagens.propriedades(content_type)
+    print(f"{'inscritos':>10} {'blocos/evento':>14}")
+    for inscritos in (10, 1000, 10000):
+        announcers_per_client.clear()
+        for client_id in range(inscritos):
+            announcers_per_client[client_id] = MessageAnnouncer()
+            announcers_per_client[client_id].listen()
+            add_interest(client_id, 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # rastreia desde o aquecimento, para o que a fila de cada ouvinte ja guarda contar nos dois lados
+            tracemalloc.start()
+            for _ in range(100):
+                process_lance_validado(None, None, properties, body)
+            antes = tracemalloc.take_snapshot()
+            for _ in range(eventos):
+                process_lance_validado(None, None, properties, body)
+            depois = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        filtro = [tracemalloc.Filter(True, __file__)]
+        blocos = sum(stat.count_diff for stat in depois.filter_traces(filtro).compare_to(antes.filter_traces(filtro), 'filename'))
+        print(f"{inscritos:>10} {blocos / eventos:>14.1f}")
+        drop_leilao(1)
+    announcers_per_client.clear()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # python APIGateway.py benchmark mede as alocacoes por evento enquanto os inscritos crescem
+    if sys.argv[1:2] == ['benchmark']:
+        benchmark()
+    else:
+        main()
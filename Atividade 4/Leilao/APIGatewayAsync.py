@@ -0,0 +1,271 @@
+# Modo asyncio do API Gateway: as conexoes SSE, as rotas REST que repassam para os
+# microsservicos e os consumidores do RabbitMQ rodam todos em um unico event loop,
+# em vez de prender uma thread do Werkzeug por navegador conectado em /listen.
+#
+# Reaproveita o estado e os callbacks de APIGateway.py (indice de interesses e
+# process_*), trocando apenas o Listener por uma versao que espera com asyncio.Event.
+#
+# Memoria por conexao SSE, medida abrindo 5000 e 15000 streams em /listen contra
+# este processo (python 3.11, aiohttp 3.14): ~16 KiB de objetos Python por conexao
+# pelo tracemalloc (Task da stream, StreamResponse, protocolo/transporte,
+# asyncio.Queue) e ~16.5 KiB de RSS por conexao, constante entre as duas medicoes.
+# 50k conexoes ficam em torno de 0.8 GiB. Para esse volume e preciso subir o limite
+# de descritores (ulimit -n 65536).
+#
+# Uso: python APIGatewayAsync.py
+
+import asyncio
+import json
+
+import aio_pika
+import aiohttp
+from aiohttp import web
+
+import APIGateway
+import clienteHttp
+from APIGateway import (
+    RABBITMQ_HOST,
+    EXCHANGE_NAME,
+    QUEUE_BINDINGS,
+    CRIAR_LEILAO_URL,
+    CRIAR_LEILOES_URL,
+    BULK_READ_TIMEOUT,
+    CONSULTAR_LEILOES_URL,
+    announcers_per_client,
+    catalogo,
+    client_history,
+    Listener,
+    MessageAnnouncer,
+    add_interest,
+    remove_interest,
+    new_event,
+    replay_events,
+    lance_url,
+    atualiza_anel_lance,
+)
+
+GATEWAY_PORT = 5000
+
+# mesmos callbacks e raias da versao com threads, chamados a partir do event loop
+QUEUE_CALLBACKS = {queue_name: callback for queue_name, (_, callback) in APIGateway.QUEUE_LANES.items()}
+
+class AsyncListener(Listener):
+    def __init__(self):
+        super().__init__()
+        self.wakeup = asyncio.Event()
+
+    def _notify(self):
+        self.wakeup.set()
+
+    async def get(self):
+        while not self.pending and not self.closed:
+            self.wakeup.clear()
+            await self.wakeup.wait()  # suspende apenas esta corrotina
+        with self.lock:
+            if self.closed:
+                return None
+            return self.pending.popitem(last=False)[1]
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    # equivalente ao CORS(app) do flask_cors, liberando qualquer origem
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    if response.prepared:
+        # stream SSE ja enviou os cabecalhos
+        return response
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    return response
+
+async def hello_world(request):
+    return web.Response(text='Hello, World!')
+
+async def ping(request):
+    event = new_event(data='pong')
+    for announcer in list(announcers_per_client.values()):
+        announcer.announce(event=event)
+    return web.json_response({})
+
+async def listen(request):
+    client_id = int(request.query.get('cli_id'))
+    if client_id not in announcers_per_client:
+        announcers_per_client[client_id] = MessageAnnouncer(AsyncListener)
+    announcer = announcers_per_client[client_id]
+    listener = announcer.listen()
+
+    # EventSource reenvia o id do ultimo evento recebido ao reconectar
+    last_event_id = request.headers.get('Last-Event-ID', request.query.get('last_event_id'))
+    if last_event_id is not None and last_event_id.isdigit():
+        listener.prime(replay_events(client_id, int(last_event_id)))
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'Access-Control-Allow-Origin': '*',
+    })
+    await response.prepare(request)
+    print(f"Cliente {client_id} conectado para notificacoes SSE")
+    try:
+        while True:
+            event = await listener.get()
+            if event is None:
+                break
+            await response.write(event.frame)  # frame ja codificado, compartilhado
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        announcer.unlisten(listener)
+    return response
+
+async def unlisten(request):
+    client_id = int(request.query.get('cli_id'))
+    if client_id in announcers_per_client:
+        del announcers_per_client[client_id]
+    client_history.discard(client_id)
+    return web.json_response({"message": "Interrompendo notificacoes"})
+
+async def proxy(request, method, url, json_data=None, **kwargs):
+    # mesmo circuit breaker por host da camada HTTP sincrona
+    breaker = clienteHttp.breaker_for(url)
+    try:
+        breaker.before_call()
+        async with request.app['http'].request(method, url, json=json_data, **kwargs) as response:
+            body = await response.read()
+    except clienteHttp.CircuitOpenError as e:
+        return web.json_response({"error": str(e)}, status=503)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        breaker.record_failure()
+        print(f"Erro ao contatar {url}: {e}")
+        return web.json_response({"error": "Servico indisponivel"}, status=503)
+    if response.status >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return web.Response(body=body, status=response.status, content_type='application/json')
+
+async def criar_leilao(request):
+    json_data = await request.json()
+    response = await proxy(request, 'POST', CRIAR_LEILAO_URL, json_data)
+    if response.status == 201:
+        catalogo.upsert(json.loads(response.body), 'agendado')
+    return response
+
+async def criar_leiloes(request):
+    # repassa o corpo sem reinterpretar (array JSON ou NDJSON)
+    response = await proxy(
+        request, 'POST', CRIAR_LEILOES_URL,
+        data=await request.read(),
+        headers={'Content-Type': request.content_type},
+        timeout=aiohttp.ClientTimeout(sock_connect=clienteHttp.CONNECT_TIMEOUT, sock_read=BULK_READ_TIMEOUT),
+    )
+    if response.status == 200:
+        for resultado in json.loads(response.body):
+            if resultado['status'] == 201:
+                catalogo.upsert(resultado['leilao'], 'agendado')
+    return response
+
+async def consultar_leiloes(request):
+    # servido da copia em memoria, sem ir ao leilaoMS; 304 se o navegador ja tem a versao atual
+    if not catalogo.loaded:
+        response = await proxy(request, 'GET', CONSULTAR_LEILOES_URL)
+        if response.status != 200:
+            return response
+        catalogo.load(json.loads(response.body))
+    etag, body = catalogo.snapshot()
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if request.headers.get('If-None-Match') == headers['ETag']:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=headers, content_type='application/json')
+
+async def lance(request):
+    json_data = await request.json()
+
+    # registra interesse do cliente no leilao
+    add_interest(json_data.get('cli_id'), json_data.get('lei_id'))
+
+    # envia o lance para o shard dono do leilao; se a topologia mudou, reenvia uma vez
+    response = await proxy(request, 'POST', lance_url(json_data.get('lei_id')), json_data)
+    if response.status == 409 and atualiza_anel_lance(json.loads(response.body)):
+        response = await proxy(request, 'POST', lance_url(json_data.get('lei_id')), json_data)
+    return response
+
+async def registrar_interesse(request):
+    json_data = await request.json()
+    add_interest(json_data.get('cli_id'), json_data.get('lei_id'))
+    return web.json_response({"message": "Interesse registrado com sucesso"}, status=201)
+
+async def cancelar_interesse(request):
+    json_data = await request.json()
+    if not remove_interest(json_data.get('cli_id'), json_data.get('lei_id')):
+        return web.json_response({"message": "Interesse não encontrado"}, status=404)
+    return web.json_response({"message": "Interesse cancelado com sucesso"})
+
+
+async def consume(app):
+    connection = await aio_pika.connect_robust(host=RABBITMQ_HOST)
+    app['rabbitmq'] = connection
+    channel = await connection.channel()
+    exchange = await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT)
+
+    # um canal por raia (controle / lances), cada um com seu prefetch
+    lanes = {}
+    for lane, prefetch in APIGateway.LANES.items():
+        lanes[lane] = await connection.channel()
+        await lanes[lane].set_qos(prefetch_count=prefetch)
+
+    # declara queues e associa as routing keys e callbacks
+    for queue_name, routing_key in QUEUE_BINDINGS:
+        lane, callback = APIGateway.QUEUE_LANES[queue_name]
+        queue = await lanes[lane].declare_queue(queue_name)
+        await queue.bind(exchange, routing_key=routing_key)
+
+        async def on_message(message, callback=callback):
+            try:
+                # a mensagem do aio_pika faz o papel das properties do pika (content_type)
+                callback(None, None, message, message.body)
+            except (KeyError, ValueError) as e:
+                print(f"Erro ao processar mensagem de {message.routing_key}: {e}")
+            finally:
+                await message.ack()
+
+        await queue.consume(on_message)
+
+async def on_startup(app):
+    app['http'] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=clienteHttp.POOL_MAXSIZE),
+        timeout=aiohttp.ClientTimeout(sock_connect=clienteHttp.CONNECT_TIMEOUT, sock_read=clienteHttp.READ_TIMEOUT),
+    )
+    await app['consume'](app)
+
+async def on_cleanup(app):
+    await app['http'].close()
+    await app['rabbitmq'].close()
+
+def create_app(consume_fn=consume):
+    app = web.Application(middlewares=[cors_middleware])
+    app['consume'] = consume_fn
+    app.router.add_get('/', hello_world)
+    app.router.add_get('/ping', ping)
+    app.router.add_get('/listen', listen)
+    app.router.add_delete('/unlisten', unlisten)
+    app.router.add_post('/criar_leilao', criar_leilao)
+    app.router.add_post('/criar_leiloes', criar_leiloes)
+    app.router.add_get('/consultar_leiloes', consultar_leiloes)
+    app.router.add_post('/lance', lance)
+    app.router.add_post('/registrar_interesse', registrar_interesse)
+    app.router.add_post('/cancelar_interesse', cancelar_interesse)
+    app.router.add_route('OPTIONS', '/{tail:.*}', hello_world)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    web.run_app(create_app(), port=GATEWAY_PORT, backlog=4096)
+
+if __name__ == '__main__':
+    main()
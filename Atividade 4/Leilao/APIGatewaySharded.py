@@ -0,0 +1,303 @@
+# Modo com shards do API Gateway: N processos do gateway asyncio (APIGatewayAsync.py)
+# atras de um unico socket de escuta na porta 5000.
+#
+# O processo principal so aceita conexoes, espia a linha de requisicao (MSG_PEEK) para
+# ler o cli_id da URL e repassa o descritor do socket (SCM_RIGHTS) para o worker dono
+# daquele cliente (cli_id % N). Assim cada worker guarda as conexoes SSE,
+# announcers_per_client e interesses apenas dos seus clientes, sem disputar o GIL com
+# os demais. Requisicoes sem cli_id (nao deveria haver, o script.js sempre envia) vao
+# em round-robin. Os workers fecham a conexao apos cada resposta REST para que uma
+# conexao keep-alive reaproveitada por outra aba nao chegue ao shard errado.
+#
+# Cada worker tem sua propria fila exclusiva no RabbitMQ ligada a todas as routing keys:
+# eventos de leilao (lance_validado, leilao_vencedor, inicio/fim) chegam a todos os
+# shards e cada um anuncia apenas para os seus inscritos; eventos direcionados a um
+# cliente (lance_invalidado, link_pagamento, status_pagamento) sao ignorados pelos
+# shards que nao sao donos do cli_id.
+#
+# Uso: python APIGatewaySharded.py [numero_de_workers]
+#
+# Com o RabbitMQ rodando, python APIGatewaySharded.py benchmark [CLIENTES] [LANCES]
+# sobe o gateway com 1, 2, 4, ... workers (ate o numero de nucleos), abre CLIENTES
+# conexoes SSE inscritas no mesmo leilao, publica LANCES lance_validado e mede os
+# eventos entregues por segundo ate todos os clientes receberem o ultimo lance.
+
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import socket
+import sys
+from urllib.parse import urlsplit, parse_qs
+
+import aio_pika
+from aiohttp import web
+
+import APIGateway
+import APIGatewayAsync
+import codecMensagens
+from APIGateway import (
+    RABBITMQ_HOST,
+    EXCHANGE_NAME,
+    QUEUE_BINDINGS,
+    ROUTING_KEY_LANCE_INVALIDADO,
+    ROUTING_KEY_LINK_PAGAMENTO,
+    ROUTING_KEY_STATUS_PAGAMENTO,
+)
+
+GATEWAY_PORT = APIGatewayAsync.GATEWAY_PORT
+
+MAX_REQUEST_LINE = 8192
+PEEK_TIMEOUT = 5.0  # segundos esperando a linha de requisicao
+
+# eventos que interessam apenas ao shard dono do cli_id
+CLIENT_EVENTS = {ROUTING_KEY_LANCE_INVALIDADO, ROUTING_KEY_LINK_PAGAMENTO, ROUTING_KEY_STATUS_PAGAMENTO}
+
+def shard_of(client_id, shards):
+    return int(client_id) % shards
+
+def client_id_from_request_line(line: bytes):
+    """Extracts cli_id from the query string of an HTTP request line.
+
+    >>> client_id_from_request_line(b'GET /listen?cli_id=42 HTTP/1.1\\r\\nHost: x')
+    42
+    >>> client_id_from_request_line(b'POST /lance HTTP/1.1\\r\\n') is None
+    True
+
+    """
+    parts = line.split(b'\r\n', 1)[0].split(b' ')
+    if len(parts) < 2:
+        return None
+    query = parse_qs(urlsplit(parts[1].decode('latin-1')).query)
+    values = query.get('cli_id')
+    if not values or not values[0].isdigit():
+        return None
+    return int(values[0])
+
+
+async def peek_request_line(loop, conn):
+    # espia os bytes sem consumi-los, o worker vai ler a requisicao inteira depois
+    while True:
+        readable = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, PEEK_TIMEOUT)
+        finally:
+            loop.remove_reader(conn.fileno())
+        data = conn.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+        if not data or b'\r\n' in data or len(data) >= MAX_REQUEST_LINE:
+            return data
+
+async def route(loop, conn, channels, round_robin):
+    try:
+        line = await peek_request_line(loop, conn)
+    except (asyncio.TimeoutError, OSError):
+        conn.close()
+        return
+    client_id = client_id_from_request_line(line)
+    if client_id is None:
+        shard = next(round_robin) % len(channels)
+    else:
+        shard = shard_of(client_id, len(channels))
+    try:
+        socket.send_fds(channels[shard], [b'c'], [conn.fileno()])
+    except OSError as e:
+        print(f"Erro ao repassar conexao para o shard {shard}: {e}")
+    conn.close()
+
+async def dispatch(listener, channels):
+    loop = asyncio.get_running_loop()
+    round_robin = itertools.count()
+    while True:
+        conn, _ = await loop.sock_accept(listener)
+        conn.setblocking(False)
+        loop.create_task(route(loop, conn, channels, round_robin))
+
+
+async def consume_shard(app, shard, shards):
+    connection = await aio_pika.connect_robust(host=RABBITMQ_HOST)
+    app['rabbitmq'] = connection
+    channel = await connection.channel()
+    exchange = await channel.declare_exchange(EXCHANGE_NAME, aio_pika.ExchangeType.DIRECT)
+
+    # uma fila exclusiva por shard e por raia (controle / lances), cada raia em um canal
+    # com prefetch proprio, ligadas as routing keys do gateway
+    queues = {}
+    for lane, prefetch in APIGateway.LANES.items():
+        lane_channel = await connection.channel()
+        await lane_channel.set_qos(prefetch_count=prefetch)
+        queues[lane] = await lane_channel.declare_queue(f'gateway_shard_{shard}_{lane}', exclusive=True)
+    callbacks = {}
+    for queue_name, routing_key in QUEUE_BINDINGS:
+        lane, callback = APIGateway.QUEUE_LANES[queue_name]
+        await queues[lane].bind(exchange, routing_key=routing_key)
+        callbacks[routing_key] = callback
+
+    async def on_message(message):
+        try:
+            if message.routing_key in CLIENT_EVENTS:
+                if shard_of(codecMensagens.decode_mensagem(message, message.body)['cli_id'], shards) != shard:
+                    return
+            callbacks[message.routing_key](None, None, message, message.body)
+        except (KeyError, ValueError) as e:
+            print(f"Erro ao processar mensagem de {message.routing_key}: {e}")
+        finally:
+            await message.ack()
+
+    for queue in queues.values():
+        await queue.consume(on_message)
+
+@web.middleware
+async def close_after_response(request, handler):
+    response = await handler(request)
+    if not response.prepared:
+        # a proxima requisicao pode ser de outro cliente, precisa passar de novo pelo roteador
+        response.force_close()
+    return response
+
+async def worker_main(shard, shards, channel):
+    app = APIGatewayAsync.create_app(consume_fn=functools.partial(consume_shard, shard=shard, shards=shards))
+    app.middlewares.append(close_after_response)
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def on_handoff():
+        try:
+            msg, fds, _, _ = socket.recv_fds(channel, 1, 1)
+        except BlockingIOError:
+            return
+        if not msg:
+            # processo principal saiu
+            stopped.set()
+            return
+        for fd in fds:
+            conn = socket.socket(fileno=fd)
+            conn.setblocking(False)
+            loop.create_task(loop.connect_accepted_socket(runner.server, conn))
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), on_handoff)
+    print(f"Shard {shard}/{shards} do gateway pronto (pid {os.getpid()})")
+    try:
+        await stopped.wait()
+    finally:
+        loop.remove_reader(channel.fileno())
+        await runner.cleanup()
+
+def run_worker(shard, shards, channel):
+    try:
+        asyncio.run(worker_main(shard, shards, channel))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    shards = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+
+    listener = socket.create_server(('', GATEWAY_PORT), backlog=4096)
+    listener.setblocking(False)
+
+    channels = []
+    workers = []
+    for shard in range(shards):
+        parent_channel, child_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        worker = multiprocessing.Process(target=run_worker, args=(shard, shards, child_channel), daemon=True)
+        worker.start()
+        child_channel.close()
+        channels.append(parent_channel)
+        workers.append(worker)
+
+    print(f"Gateway com {shards} shards escutando na porta {GATEWAY_PORT}")
+    try:
+        asyncio.run(dispatch(listener, channels))
+    except KeyboardInterrupt:
+        pass
+    for channel in channels:
+        channel.close()
+    for worker in workers:
+        worker.join(timeout=5)
+
+BENCHMARK_LEILAO = 1
+
+async def _clientes_sse(inicio, fim, lances, pronto):
+    import aiohttp
+
+    url = f'http://127.0.0.1:{GATEWAY_PORT}'
+    marca = f'"lance": {lances}}}'.encode()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        streams = []
+        for client_id in range(inicio, fim):
+            streams.append(await session.get(f'{url}/listen?cli_id={client_id}', timeout=aiohttp.ClientTimeout()))
+            async with session.post(f'{url}/registrar_interesse?cli_id={client_id}',
+                                    json={'cli_id': client_id, 'lei_id': BENCHMARK_LEILAO}) as response:
+                response.raise_for_status()
+
+        async def espera_ultimo(stream):
+            # lances intermediarios podem ser mesclados para clientes lentos; o ultimo sempre chega
+            async for line in stream.content:
+                if line.startswith(b'data:') and line.rstrip().endswith(marca):
+                    return
+
+        await asyncio.get_running_loop().run_in_executor(None, pronto.wait)
+        await asyncio.gather(*(espera_ultimo(stream) for stream in streams))
+        for stream in streams:
+            stream.close()
+
+def _grupo_de_clientes(inicio, fim, lances, pronto, resultado):
+    import time
+
+    asyncio.run(_clientes_sse(inicio, fim, lances, pronto))
+    resultado.put(time.time())
+
+def benchmark(clientes=2000, lances=200, max_shards=os.cpu_count()):
+    import json
+    import subprocess
+    import time
+
+    import pika
+
+    # os clientes SSE ficam em outros processos para nao limitar a medida
+    grupos = max(1, min(clientes, os.cpu_count() // 2 or 1))
+    print(f"{'workers':>7} {'eventos/s':>12}  ({clientes} clientes SSE, {lances} lances no mesmo leilao)")
+    shards = 1
+    while True:
+        gateway = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(shards)])
+        try:
+            time.sleep(3)  # workers sobem e declaram suas filas
+            pronto = multiprocessing.Barrier(grupos + 1)
+            resultado = multiprocessing.Queue()
+            processos = []
+            for grupo in range(grupos):
+                inicio, fim = clientes * grupo // grupos, clientes * (grupo + 1) // grupos
+                processo = multiprocessing.Process(target=_grupo_de_clientes, args=(inicio, fim, lances, pronto, resultado))
+                processo.start()
+                processos.append(processo)
+            pronto.wait()
+
+            connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
+            channel = connection.channel()
+            properties = pika.BasicProperties(content_type=codecMensagens.JSON)
+            comeco = time.time()
+            for lance in range(1, lances + 1):
+                body = json.dumps({'lei_id': BENCHMARK_LEILAO, 'cli_id': 0, 'lance': lance})
+                channel.basic_publish(EXCHANGE_NAME, APIGateway.ROUTING_KEY_LANCE_VALIDADO, body, properties)
+            connection.close()
+            fim = max(resultado.get() for _ in processos)
+            for processo in processos:
+                processo.join()
+        finally:
+            gateway.terminate()
+            gateway.wait()
+        print(f"{shards:>7} {clientes * lances / (fim - comeco):>12,.0f}")
+        if shards >= max_shards:
+            break
+        shards = min(shards * 2, max_shards)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['benchmark']:
+        benchmark(*(int(arg) for arg in sys.argv[2:4]))
+    else:
+        main()
@@ -0,0 +1,117 @@
+# Agendador de inicio/fim de leiloes do leilaoMS.
+#
+# Substitui o polling do modulo schedule (run_pending + sleep(1)) por um min-heap de
+# prazos: a thread dorme exatamente ate o proximo prazo (precisao de milissegundos),
+# em vez de acordar a cada segundo e varrer todos os jobs. Agendar, cancelar e
+# reagendar custam O(log n); cancelamentos sao preguicosos (a entrada antiga fica no
+# heap e e ignorada quando sai). Todos os leiloes com o mesmo prazo sao entregues ao
+# callback em um unico lote, por tipo de evento.
+#
+# Uso:
+#     scheduler = AuctionScheduler(on_due=lambda evento, lei_ids: ...)
+#     scheduler.schedule(lei_id, evento, data_em_segundos_epoch)
+#     scheduler.run()  # ou scheduler.start() para rodar em uma thread
+
+import heapq
+import itertools
+import threading
+import time
+
+class AuctionScheduler:
+    def __init__(self, on_due):
+        self.on_due = on_due
+        self.heap = []
+        # (lei_id, evento) -> entrada viva no heap
+        self.entries = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.thread = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, lei_id, evento, when):
+        # reagendar e so agendar de novo: a entrada anterior vira lixo no heap
+        with self.cond:
+            entry = [when, next(self.counter), lei_id, evento, True]
+            old = self.entries.pop((lei_id, evento), None)
+            if old is not None:
+                old[-1] = False
+            self.entries[(lei_id, evento)] = entry
+            heapq.heappush(self.heap, entry)
+            # acorda a thread se o novo prazo vem antes do que ela esta esperando
+            if self.heap[0] is entry:
+                self.cond.notify()
+
+    def schedule_many(self, items):
+        # items: iteravel de (lei_id, evento, when), agendados sob um unico lock
+        with self.cond:
+            for lei_id, evento, when in items:
+                entry = [when, next(self.counter), lei_id, evento, True]
+                old = self.entries.pop((lei_id, evento), None)
+                if old is not None:
+                    old[-1] = False
+                self.entries[(lei_id, evento)] = entry
+                self.heap.append(entry)
+            # um heapify O(n) no fim sai mais barato que n heappush para cargas grandes
+            heapq.heapify(self.heap)
+            self.cond.notify()
+
+    def cancel(self, lei_id, evento=None):
+        with self.cond:
+            keys = [(lei_id, evento)] if evento is not None else [key for key in self.entries if key[0] == lei_id]
+            cancelled = False
+            for key in keys:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    entry[-1] = False
+                    cancelled = True
+            return cancelled
+
+    def _pop_due(self):
+        # retorna o lote de entradas com o menor prazo, ou quanto falta para ele
+        while self.heap and not self.heap[0][-1]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None, None
+        deadline = self.heap[0][0]
+        remaining = deadline - time.time()
+        if remaining > 0:
+            return None, remaining
+        batch = []
+        while self.heap and (self.heap[0][0] == deadline or not self.heap[0][-1]):
+            entry = heapq.heappop(self.heap)
+            if entry[-1]:
+                del self.entries[(entry[2], entry[3])]
+                batch.append(entry)
+        return batch, None
+
+    def run(self):
+        while not self.stopping:
+            with self.cond:
+                batch, remaining = self._pop_due()
+                if batch is None:
+                    # prazos muito distantes passariam do maior timeout aceito (OverflowError)
+                    self.cond.wait(remaining if remaining is None else min(remaining, threading.TIMEOUT_MAX))
+                    continue
+            # agrupa por tipo de evento preservando a ordem de agendamento
+            por_evento = {}
+            for _, _, lei_id, evento, _ in batch:
+                por_evento.setdefault(evento, []).append(lei_id)
+            for evento, lei_ids in por_evento.items():
+                # um callback com erro nao pode parar o agendador dos demais leiloes
+                try:
+                    self.on_due(evento, lei_ids)
+                except Exception as e:
+                    print(f"Erro ao disparar evento {evento} de {len(lei_ids)} leiloes: {e!r}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True, name='agendador')
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
@@ -0,0 +1,103 @@
+# Anel de hash consistente que distribui os leiloes (lei_id) entre instancias do lanceMS.
+#
+# Cada shard ocupa VNODES pontos no anel; o dono de um leilao e o primeiro ponto no
+# sentido horario a partir do hash do lei_id. Ao adicionar um shard, so mudam de dono os
+# leiloes que caem nos arcos que ele assumiu (~1/N do total), o resto fica onde estava.
+#
+# A topologia ({"versao": n, "shards": {nome: url}}) fica em TOPOLOGY_PATH, lida na
+# partida por gateway, leilaoMS e lanceMS. leilaoMS publica leilao_iniciado/finalizado
+# tambem com a routing key do shard dono (routing_key('leilao_iniciado', 'lance1') ->
+# 'leilao_iniciado.lance1'), e cada lanceMS consome so as filas do seu shard.
+#
+# Adicionar um shard (com o novo lanceMS ja rodando):
+#     python anelHash.py adicionar lance1 http://127.0.0.1:5003
+# O comando envia a nova topologia para o shard novo, para os shards antigos (que
+# repassam os leiloes ativos que mudaram de dono via /importar) e para o leilaoMS, e
+# grava o arquivo. Os gateways aprendem a topologia nova na primeira resposta 409 de um
+# shard que deixou de ser dono do leilao.
+
+import bisect
+import hashlib
+import json
+import os
+import sys
+
+import clienteHttp
+
+VNODES = 128
+TOPOLOGY_PATH = 'topologia_lance.json'
+# implantacao padrao: um unico lanceMS, na porta de sempre
+DEFAULT_TOPOLOGY = {'versao': 0, 'shards': {'lance0': 'http://127.0.0.1:5002'}}
+LEILAO_TOPOLOGIA_URL = 'http://127.0.0.1:5001/topologia'
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+def routing_key(base, shard):
+    return f"{base}.{shard}"
+
+class HashRing:
+    """Immutable ring; a topology change builds a new ring and swaps the reference."""
+
+    def __init__(self, topologia, vnodes=VNODES):
+        self.versao = topologia['versao']
+        self.shards = dict(topologia['shards'])
+        points = sorted(
+            (_hash(f"{nome}#{i}"), nome)
+            for nome in self.shards
+            for i in range(vnodes)
+        )
+        self.hashes = [h for h, _ in points]
+        self.owners = [nome for _, nome in points]
+
+    def owner(self, lei_id):
+        index = bisect.bisect(self.hashes, _hash(lei_id)) % len(self.hashes)
+        return self.owners[index]
+
+    def url(self, lei_id):
+        return self.shards[self.owner(lei_id)]
+
+    def topologia(self):
+        return {'versao': self.versao, 'shards': dict(self.shards)}
+
+    def with_shard(self, nome, url):
+        shards = dict(self.shards)
+        shards[nome] = url
+        return HashRing({'versao': self.versao + 1, 'shards': shards})
+
+    def moved(self, lei_ids, other):
+        # lei_id -> novo dono, so para os leiloes que mudam de shard
+        return {lei_id: other.owner(lei_id) for lei_id in lei_ids if other.owner(lei_id) != self.owner(lei_id)}
+
+def load(path=TOPOLOGY_PATH):
+    if not os.path.exists(path):
+        return HashRing(DEFAULT_TOPOLOGY)
+    with open(path) as f:
+        return HashRing(json.load(f))
+
+def save(ring, path=TOPOLOGY_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(ring.topologia(), f)
+    os.replace(tmp_path, path)
+
+def adicionar_shard(nome, url, path=TOPOLOGY_PATH):
+    atual = load(path)
+    novo = atual.with_shard(nome, url)
+    topologia = novo.topologia()
+    # o shard novo primeiro, para ja aceitar os leiloes que vai receber
+    clienteHttp.post(f"{url}/topologia", json=topologia).raise_for_status()
+    for antigo, antigo_url in atual.shards.items():
+        response = clienteHttp.post(f"{antigo_url}/topologia", json=topologia)
+        response.raise_for_status()
+        print(f"{antigo}: {response.json()['movidos']} leiloes repassados")
+    clienteHttp.post(LEILAO_TOPOLOGIA_URL, json=topologia).raise_for_status()
+    save(novo, path)
+    return novo
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'adicionar':
+        print("Uso: python anelHash.py adicionar [NOME] [URL]")
+        sys.exit(1)
+    anel = adicionar_shard(sys.argv[2], sys.argv[3])
+    print(f"Topologia versao {anel.versao}: {anel.shards}")
@@ -0,0 +1,190 @@
+# Armazenamento duravel dos leiloes do leilaoMS em SQLite (modo WAL).
+#
+# As escritas (leilao criado, mudanca de estado) sao enfileiradas e gravadas por uma
+# thread dedicada em lotes: cada transacao junta tudo o que chegou enquanto a anterior
+# era gravada, ate BATCH_SIZE operacoes, entao o custo de commit e dividido entre
+# varios leiloes. load_all() le tudo de uma vez na partida para reconstruir o catalogo
+# e reagendar inicio/fim. Se um lote falhar, as operacoes sao regravadas uma a uma para
+# so a invalida se perder.
+#
+# Uso:
+#     store = AuctionStore('leiloes.db').start()
+#     store.save(leilao, 'agendado')
+#     store.set_status(lei_id, 'finalizado')
+#
+# python armazemLeiloes.py [LEILOES] grava LEILOES leiloes (90% finalizados) em um banco
+# temporario e mede a gravacao em lotes e a reidratacao da partida do leilaoMS.
+
+import itertools
+import queue
+import sqlite3
+import threading
+
+DB_PATH = 'leiloes.db'
+BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leiloes (
+    lei_id INTEGER PRIMARY KEY,
+    nome TEXT NOT NULL,
+    desc TEXT NOT NULL,
+    lance_inic REAL NOT NULL,
+    data_inic REAL NOT NULL,
+    data_fim REAL NOT NULL,
+    status TEXT NOT NULL
+)
+"""
+
+INSERT = "INSERT OR REPLACE INTO leiloes (lei_id, nome, desc, lance_inic, data_inic, data_fim, status) VALUES (?, ?, ?, ?, ?, ?, ?)"
+UPDATE_STATUS = "UPDATE leiloes SET status = ? WHERE lei_id = ?"
+
+def _numero(value):
+    # colunas REAL devolvem float; volta para int quando nao ha parte decimal (ex.: lance_inic 100)
+    return int(value) if value.is_integer() else value
+
+class AuctionStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='armazem-leiloes')
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # com WAL, NORMAL so perde as ultimas transacoes em queda de energia, nunca corrompe
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        connection = self._connect()
+        connection.execute(SCHEMA)
+        connection.commit()
+        connection.close()
+        self.thread.start()
+        return self
+
+    @staticmethod
+    def _row(leilao, status):
+        # recusa na hora o que o SQLite recusaria depois, ja fora da requisicao
+        if not isinstance(leilao['lei_id'], int) or isinstance(leilao['lei_id'], bool):
+            raise ValueError(f"lei_id invalido: {leilao['lei_id']!r}")
+        for campo in ('nome', 'desc'):
+            if not isinstance(leilao[campo], str):
+                raise ValueError(f"{campo} deve ser texto: {leilao[campo]!r}")
+        for campo in ('lance_inic', 'data_inic', 'data_fim'):
+            if not isinstance(leilao[campo], (int, float)) or isinstance(leilao[campo], bool):
+                raise ValueError(f"{campo} deve ser numero: {leilao[campo]!r}")
+        return (
+            leilao['lei_id'], leilao['nome'], leilao['desc'], leilao['lance_inic'],
+            leilao['data_inic'], leilao['data_fim'], status,
+        )
+
+    def save(self, leilao, status):
+        self.pending.put((INSERT, [self._row(leilao, status)]))
+
+    def save_many(self, leiloes, status):
+        # um unico item na fila, gravado com um executemany
+        if leiloes:
+            self.pending.put((INSERT, [self._row(leilao, status) for leilao in leiloes]))
+
+    def set_status(self, lei_id, status):
+        if not isinstance(status, str):
+            raise ValueError(f"status deve ser texto: {status!r}")
+        self.pending.put((UPDATE_STATUS, [(status, lei_id)]))
+
+    def flush(self):
+        # espera todas as escritas enfileiradas serem gravadas
+        self.pending.join()
+
+    def load_all(self):
+        connection = self._connect()
+        try:
+            cursor = connection.execute(
+                "SELECT lei_id, nome, desc, lance_inic, data_inic, data_fim, status FROM leiloes"
+            )
+            for lei_id, nome, desc, lance_inic, data_inic, data_fim, status in cursor:
+                yield {
+                    'lei_id': lei_id,
+                    'nome': nome,
+                    'desc': desc,
+                    'lance_inic': _numero(lance_inic),
+                    'data_inic': _numero(data_inic),
+                    'data_fim': _numero(data_fim),
+                }, status
+        finally:
+            connection.close()
+
+    def _run(self):
+        connection = self._connect()
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with connection:
+                    # operacoes seguidas do mesmo tipo viram um unico executemany
+                    for sql, group in itertools.groupby(batch, key=lambda op: op[0]):
+                        connection.executemany(sql, [params for _, rows in group for params in rows])
+            except sqlite3.Error as e:
+                print(f"Erro ao gravar {len(batch)} operacoes de leiloes, regravando uma a uma: {e}")
+                self._write_one_by_one(connection, batch)
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def _write_one_by_one(self, connection, batch):
+        # cada linha na propria transacao: so a operacao invalida se perde
+        for sql, rows in batch:
+            for params in rows:
+                try:
+                    with connection:
+                        connection.execute(sql, params)
+                except sqlite3.Error as e:
+                    print(f"Descartando operacao de leilao {params}: {e}")
+
+def benchmark(leiloes=1000000, finalizados=0.9):
+    import os
+    import tempfile
+    import time
+
+    import agendador
+    import catalogoLeiloes
+
+    with tempfile.TemporaryDirectory() as pasta:
+        store = AuctionStore(os.path.join(pasta, 'leiloes.db')).start()
+        agora = time.time()
+        corte = int(leiloes * finalizados)
+        inicio = time.perf_counter()
+        for comeco in range(0, leiloes, BATCH_SIZE):
+            lote = [{
+                'lei_id': lei_id, 'nome': f'leilao {lei_id}', 'desc': 'descricao', 'lance_inic': 100,
+                'data_inic': agora + lei_id - corte, 'data_fim': agora + lei_id - corte + 3600,
+            } for lei_id in range(comeco, min(comeco + BATCH_SIZE, leiloes))]
+            status = catalogoLeiloes.FINALIZADO if comeco < corte else catalogoLeiloes.AGENDADO
+            store.save_many(lote, status)
+        store.flush()
+        print(f"gravacao de {leiloes} leiloes em lotes: {time.perf_counter() - inicio:.2f}s")
+
+        # mesmos passos de leilaoMS.reidrata_leiloes (1 e 0 sao INICIAR e FINALIZAR)
+        inicio = time.perf_counter()
+        items = list(store.load_all())
+        lidos = time.perf_counter()
+        catalogoLeiloes.AuctionCatalog().load(items)
+        carregados = time.perf_counter()
+        eventos = []
+        for leilao, status in items:
+            if status == catalogoLeiloes.AGENDADO:
+                eventos.append((leilao['lei_id'], 1, leilao['data_inic']))
+            if status != catalogoLeiloes.FINALIZADO:
+                eventos.append((leilao['lei_id'], 0, leilao['data_fim']))
+        agendador.AuctionScheduler(on_due=None).schedule_many(eventos)
+        fim = time.perf_counter()
+        print(f"reidratacao: {fim - inicio:.2f}s (leitura {lidos - inicio:.2f}s, catalogo "
+              f"{carregados - lidos:.2f}s, {len(eventos)} eventos agendados {fim - carregados:.2f}s)")
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*(int(arg) for arg in sys.argv[1:2]))
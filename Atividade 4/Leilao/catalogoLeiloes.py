@@ -0,0 +1,173 @@
+# Catalogo de leiloes do leilaoMS.
+#
+# - ids alocados em O(1) por um contador, sem varrer a lista de leiloes;
+# - busca por id em um dict;
+# - um balde por estado (agendado, em andamento, finalizado), cada um ordenado pela
+#   data de referencia do estado: data_inic para agendados, data_fim para os demais.
+#   Os leiloes mudam de balde quando o agendador dispara inicio/fim (mark_started /
+#   mark_finished), nao a cada consulta;
+# - o JSON de cada leilao e serializado uma vez e reaproveitado ate o estado mudar.
+#
+# query() filtra por estado e janela de tempo (sobre a data de referencia) e pagina
+# com limit + cursor, entao o custo de uma pagina depende do tamanho da pagina e nao
+# do historico de leiloes finalizados.
+
+import bisect
+import json
+import threading
+
+AGENDADO = 'agendado'
+EM_ANDAMENTO = 'em andamento'
+FINALIZADO = 'finalizado'
+
+STATUS = (AGENDADO, EM_ANDAMENTO, FINALIZADO)
+# campo usado para ordenar cada balde
+SORT_FIELD = {AGENDADO: 'data_inic', EM_ANDAMENTO: 'data_fim', FINALIZADO: 'data_fim'}
+
+PUBLIC_FIELDS = ('lei_id', 'nome', 'desc', 'lance_inic', 'data_inic', 'data_fim')
+
+class InvalidCursor(ValueError):
+    pass
+
+class AuctionCatalog:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.next_id = 0
+        self.leiloes = {}
+        self.status = {}
+        self.json_cache = {}
+        # estado -> lista ordenada de (data de referencia, lei_id)
+        self.buckets = {status: [] for status in STATUS}
+
+    def __len__(self):
+        return len(self.leiloes)
+
+    def __contains__(self, lei_id):
+        return lei_id in self.leiloes
+
+    def get(self, lei_id):
+        return self.leiloes.get(lei_id)
+
+    def allocate_ids(self, count=1):
+        # devolve o primeiro id de um bloco contiguo de `count` ids
+        with self.lock:
+            first = self.next_id
+            self.next_id += count
+            return first
+
+    def add(self, leilao, status=AGENDADO):
+        with self.lock:
+            lei_id = leilao['lei_id']
+            if lei_id >= self.next_id:
+                self.next_id = lei_id + 1
+            self.leiloes[lei_id] = leilao
+            self._place(lei_id, status)
+
+    def add_many(self, leiloes, status=AGENDADO):
+        # insercao em lote: estende o balde e reordena uma vez (timsort aproveita os trechos ja ordenados)
+        with self.lock:
+            bucket = self.buckets[status]
+            for leilao in leiloes:
+                lei_id = leilao['lei_id']
+                if lei_id >= self.next_id:
+                    self.next_id = lei_id + 1
+                self.leiloes[lei_id] = leilao
+                self.status[lei_id] = status
+                self.json_cache.pop(lei_id, None)
+                bucket.append((leilao[SORT_FIELD[status]], lei_id))
+            bucket.sort()
+
+    def load(self, items):
+        # carga em bloco na partida: ordena cada balde uma unica vez
+        with self.lock:
+            for leilao, status in items:
+                lei_id = leilao['lei_id']
+                self.leiloes[lei_id] = leilao
+                self.status[lei_id] = status
+                self.buckets[status].append((leilao[SORT_FIELD[status]], lei_id))
+                if lei_id >= self.next_id:
+                    self.next_id = lei_id + 1
+            for bucket in self.buckets.values():
+                bucket.sort()
+            self.json_cache.clear()
+
+    def _place(self, lei_id, status):
+        leilao = self.leiloes[lei_id]
+        bisect.insort(self.buckets[status], (leilao[SORT_FIELD[status]], lei_id))
+        self.status[lei_id] = status
+        self.json_cache.pop(lei_id, None)
+
+    def _move(self, lei_id, status):
+        with self.lock:
+            atual = self.status.get(lei_id)
+            if atual is None or atual == status:
+                return False
+            bucket = self.buckets[atual]
+            item = (self.leiloes[lei_id][SORT_FIELD[atual]], lei_id)
+            index = bisect.bisect_left(bucket, item)
+            if index < len(bucket) and bucket[index] == item:
+                del bucket[index]
+            self._place(lei_id, status)
+            return True
+
+    def mark_started(self, lei_id):
+        return self._move(lei_id, EM_ANDAMENTO)
+
+    def mark_finished(self, lei_id):
+        return self._move(lei_id, FINALIZADO)
+
+    def to_json(self, lei_id):
+        # fragmento JSON do leilao, serializado so quando o estado muda
+        fragment = self.json_cache.get(lei_id)
+        if fragment is None:
+            leilao = self.leiloes[lei_id]
+            body = {field: leilao[field] for field in PUBLIC_FIELDS}
+            body['status'] = self.status[lei_id]
+            fragment = json.dumps(body)
+            self.json_cache[lei_id] = fragment
+        return fragment
+
+    def query(self, status=None, desde=None, ate=None, limit=None, cursor=None):
+        """Returns (list of JSON fragments, next cursor or None).
+
+        Results are ordered by state (agendado, em andamento, finalizado) and then by the
+        state's reference date. The cursor is opaque to clients.
+        """
+        statuses = STATUS if status is None else (status,)
+        start_status, start_item = self._decode_cursor(cursor)
+        fragments = []
+        last = None
+        with self.lock:
+            for status_index, bucket_status in enumerate(STATUS):
+                if bucket_status not in statuses or status_index < start_status:
+                    continue
+                bucket = self.buckets[bucket_status]
+                lo = 0
+                if desde is not None:
+                    lo = bisect.bisect_left(bucket, (desde, -1))
+                if status_index == start_status and start_item is not None:
+                    lo = max(lo, bisect.bisect_right(bucket, start_item))
+                hi = len(bucket)
+                if ate is not None:
+                    hi = max(lo, bisect.bisect_left(bucket, (ate, -1), lo))
+                for index in range(lo, hi):
+                    if limit is not None and len(fragments) >= limit:
+                        # ainda ha resultados: o cursor aponta para o ultimo devolvido
+                        return fragments, self._encode_cursor(*last)
+                    fragments.append(self.to_json(bucket[index][1]))
+                    last = (status_index, bucket[index])
+        return fragments, None
+
+    @staticmethod
+    def _encode_cursor(status_index, item):
+        return f"{status_index}:{item[0]}:{item[1]}"
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        if cursor is None:
+            return 0, None
+        try:
+            status_index, key, lei_id = cursor.split(':')
+            return int(status_index), (float(key), int(lei_id))
+        except ValueError:
+            raise InvalidCursor(cursor)
@@ -0,0 +1,117 @@
+# Camada HTTP de saida compartilhada pelos servicos da Atividade 4.
+#
+# Cada host (leilaoMS, lanceMS, pagamentoMS, sistemaPagamento) ganha uma requests.Session
+# propria com pool de conexoes keep-alive, timeouts de conexao/leitura, retentativas
+# limitadas apenas para metodos idempotentes e um circuit breaker que falha na hora
+# quando o servico esta fora do ar, em vez de prender a thread do chamador.
+#
+# Uso:
+#     import clienteHttp
+#     response = clienteHttp.post(URL, json=body)  # pode levantar requests.RequestException
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 1.0  # segundos
+READ_TIMEOUT = 5.0  # segundos
+POOL_MAXSIZE = 32  # conexoes keep-alive por host
+IDEMPOTENT_RETRIES = 2
+RETRY_BACKOFF = 0.1  # segundos, dobra a cada tentativa
+
+BREAKER_FAILURES = 5  # falhas seguidas ate abrir o circuito
+BREAKER_RESET = 10.0  # segundos ate deixar uma chamada de teste passar
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while the host's circuit is open."""
+
+class CircuitBreaker:
+    CLOSED = 'fechado'
+    OPEN = 'aberto'
+    HALF_OPEN = 'meio aberto'
+
+    def __init__(self, host, max_failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.host = host
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def before_call(self):
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return
+            if self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # deixa uma unica chamada de teste passar
+                self.state = CircuitBreaker.HALF_OPEN
+                return
+            raise CircuitOpenError(f"Circuito aberto para {self.host}")
+
+    def record_success(self):
+        with self.lock:
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.max_failures:
+                if self.state != CircuitBreaker.OPEN:
+                    print(f"Circuito aberto para {self.host} apos {self.failures} falhas")
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def _new_session():
+    retry = Retry(
+        total=IDEMPOTENT_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        # POST nao e repetido depois de enviado, apenas se a conexao nem abriu
+        allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}),
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _host(url):
+    host = urlsplit(url).netloc
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = (_new_session(), CircuitBreaker(host))
+        return _hosts[host]
+
+def breaker_for(url):
+    return _host(url)[1]
+
+def request(method, url, **kwargs):
+    session, breaker = _host(url)
+    breaker.before_call()
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -0,0 +1,144 @@
+# Codec das mensagens trocadas pelo RabbitMQ.
+#
+# O formato vai na propriedade content_type da mensagem AMQP, entao cada consumidor
+# decodifica pelo que recebeu e cada produtor escolhe o que envia:
+#   - application/json (JSON): padrao, e o que se assume quando content_type falta;
+#   - application/x-leilao-struct (BINARIO): layout fixo com struct para as mensagens de
+#     lance, que sao as mais frequentes. O primeiro byte identifica o layout, os campos
+#     numericos vem em seguida (little-endian) e os campos de tamanho variavel (texto,
+#     assinatura) levam um prefixo de 2 bytes com o tamanho.
+# Eventos sem layout binario saem em JSON mesmo quando BINARIO e pedido.
+#
+# Uso:
+#     body, content_type = codecMensagens.encode('lance_validado', dados, codecMensagens.BINARIO)
+#     channel.basic_publish(..., body=body, properties=codecMensagens.propriedades(content_type))
+#     dados = codecMensagens.decode_mensagem(properties, body)
+#
+# python codecMensagens.py mede custo de encode/decode e bytes por mensagem de cada evento.
+
+import json
+import struct
+
+import pika
+
+JSON = 'application/json'
+BINARIO = 'application/x-leilao-struct'
+
+VAR_LENGTH = struct.Struct('<H')
+
+def _number(value):
+    # lances viajam como double; volta para int quando nao ha parte decimal
+    return int(value) if value.is_integer() else value
+
+class Layout:
+    def __init__(self, tag, evento, fixed_format, fixed_fields, var_fields=(), const=None):
+        self.tag = tag
+        self.evento = evento
+        self.fixed = struct.Struct('<B' + fixed_format)
+        self.fixed_fields = fixed_fields
+        # (nome, 'str' | 'bytes')
+        self.var_fields = var_fields
+        self.const = const or {}
+        self.floats = [i for i, code in enumerate(fixed_format) if code == 'd']
+
+    def pack(self, data):
+        parts = [self.fixed.pack(self.tag, *(data[field] for field in self.fixed_fields))]
+        for field, kind in self.var_fields:
+            value = data[field]
+            if kind == 'str':
+                value = value.encode()
+            elif isinstance(value, str):
+                value = bytes.fromhex(value)
+            parts.append(VAR_LENGTH.pack(len(value)))
+            parts.append(value)
+        return b''.join(parts)
+
+    def unpack(self, body):
+        values = list(self.fixed.unpack_from(body)[1:])
+        for index in self.floats:
+            values[index] = _number(values[index])
+        data = dict(zip(self.fixed_fields, values))
+        offset = self.fixed.size
+        for field, kind in self.var_fields:
+            (length,) = VAR_LENGTH.unpack_from(body, offset)
+            offset += VAR_LENGTH.size
+            value = body[offset:offset + length]
+            offset += length
+            data[field] = value.decode() if kind == 'str' else value
+        data.update(self.const)
+        return data
+
+LAYOUTS = {}
+TAGS = {}
+
+def register(layout):
+    LAYOUTS[layout.evento] = layout
+    TAGS[layout.tag] = layout
+
+LANCE_FIELDS = ('lei_id', 'cli_id', 'lance')
+register(Layout(1, 'lance_realizado', 'qqd', LANCE_FIELDS, var_fields=(('signature', 'bytes'),)))
+register(Layout(2, 'lance_validado', 'qqd', LANCE_FIELDS))
+register(Layout(3, 'lance_invalidado', 'qqd', LANCE_FIELDS))
+# notificacao de lance para os clientes de um leilao (Atividade 1)
+register(Layout(4, 'leilao_lance', 'qqd', LANCE_FIELDS, const={'evento': 'lance'}))
+
+def _jsonable(data):
+    return {key: value.hex() if isinstance(value, bytes) else value for key, value in data.items()}
+
+def encode(evento, data, formato=JSON):
+    """Returns (body, content_type); falls back to JSON when evento has no binary layout."""
+    layout = LAYOUTS.get(evento)
+    if formato == BINARIO and layout is not None:
+        try:
+            return layout.pack(data), BINARIO
+        except (struct.error, KeyError, TypeError):
+            # campo ausente ou fora do tipo do layout (ex.: id em texto): vai em JSON
+            pass
+    return json.dumps(_jsonable(data)).encode(), JSON
+
+def decode(body, content_type=None):
+    if content_type == BINARIO:
+        return TAGS[body[0]].unpack(body)
+    return json.loads(body)
+
+def decode_mensagem(properties, body):
+    # properties do pika ou mensagem do aio_pika (ambos tem content_type), ou None
+    return decode(body, getattr(properties, 'content_type', None))
+
+def bytes_assinados(data):
+    # representacao canonica de um lance, assinada pelo cliente e verificada pelo lanceMS
+    # sem depender do formato em que a mensagem viajou
+    return LAYOUTS['lance_realizado'].fixed.pack(0, *(data[field] for field in LANCE_FIELDS))
+
+_properties = {}
+
+def propriedades(content_type):
+    properties = _properties.get(content_type)
+    if properties is None:
+        properties = _properties[content_type] = pika.BasicProperties(content_type=content_type)
+    return properties
+
+def benchmark(repeticoes=100000):
+    import timeit
+
+    amostras = {
+        'lance_realizado': {'lei_id': 12, 'cli_id': 3, 'lance': 150, 'signature': bytes(256)},
+        'lance_validado': {'lei_id': 12, 'cli_id': 3, 'lance': 150},
+        'lance_invalidado': {'lei_id': 12, 'cli_id': 3, 'lance': 90},
+        'leilao_lance': {'lei_id': 12, 'cli_id': 3, 'lance': 150, 'evento': 'lance'},
+        'leilao_iniciado': {'lei_id': 12, 'nome': 'vaso', 'desc': 'vaso antigo', 'lance_inic': 100,
+                            'data_inic': 1760000000, 'data_fim': 1760000030},
+        'leilao_vencedor': {'lei_id': 12, 'cli_id': 3, 'lance': 150, 'nome': 'vaso', 'desc': 'vaso antigo'},
+    }
+    print(f"{'evento':<18} {'formato':<28} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for evento, data in amostras.items():
+        for formato in (JSON, BINARIO):
+            body, content_type = encode(evento, data, formato)
+            if content_type != formato:
+                continue
+            enc = timeit.timeit(lambda: encode(evento, data, formato), number=repeticoes) / repeticoes * 1e6
+            dec = timeit.timeit(lambda: decode(body, content_type), number=repeticoes) / repeticoes * 1e6
+            print(f"{evento:<18} {content_type:<28} {len(body):>6} {enc:>10.2f} {dec:>10.2f}")
+
+if __name__ == '__main__':
+    benchmark()
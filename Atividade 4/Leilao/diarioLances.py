@@ -0,0 +1,306 @@
+# Diario (write-ahead log) de lances do lanceMS.
+#
+# Cada decisao do motor de lances (leilao aberto, lance aceito, leilao finalizado) vira
+# um registro binario anexado ao arquivo do diario. Uma thread de escrita junta todos
+# os registros que chegaram enquanto o lote anterior era gravado e faz um unico fsync
+# por lote (group commit). So depois do fsync ela roda os callbacks on_durable dos
+# registros, na ordem do diario; o lanceMS publica lance_validado/leilao_vencedor
+# nesse callback, entao nada e anunciado antes de estar em disco. Depois que o broker
+# confirma o leilao_vencedor, o lanceMS anexa um registro ANNOUNCED; leiloes finalizados
+# sem esse registro sao anunciados de novo na partida.
+#
+# Se a escrita ou o fsync falhar (disco cheio, EIO), o diario fica marcado como falho
+# e append/wait passam a levantar JournalFailed: nenhuma decisao nova e confirmada sem
+# estar em disco. Um callback on_durable que levanta so e registrado no log.
+#
+# A thread de escrita mantem um espelho dos lances de topo por leilao. A cada
+# SNAPSHOT_EVERY registros ela grava esse espelho em um snapshot (arquivo temporario +
+# fsync + rename), deixando de fora os leiloes ja anunciados, e recomeca o diario vazio. Na partida, recover() le o snapshot e
+# reaplica a cauda do diario, descartando um ultimo registro incompleto ou corrompido.
+#
+# Formato de cada registro: cabecalho <tipo:u8, tamanho:u32, crc32:u32> + payload.
+#
+# python diarioLances.py [THREADS] [LEILOES] [LANCES] mede lances/s com e sem fsync
+# (cada thread espera o proprio registro chegar ao disco, como o /lance) e confere que
+# recover() reconstroi o mesmo estado do motor.
+
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import motorLances
+
+JOURNAL_PATH = 'lances.journal'
+SNAPSHOT_PATH = 'lances.snapshot'
+BATCH_SIZE = 4096
+SNAPSHOT_EVERY = 100000  # registros no diario antes de compactar
+
+OPEN = 1
+BID = 2
+FINALIZE = 3
+DROP = 4  # leilao repassado para outro shard
+ANNOUNCED = 5  # leilao_vencedor confirmado pelo broker
+
+HEADER = struct.Struct('<BII')
+BID_PAYLOAD = struct.Struct('<qqd')  # lei_id, cli_id, lance
+OPEN_PAYLOAD = struct.Struct('<qd')  # lei_id, lance_inic (seguido de nome/desc em JSON)
+FINALIZE_PAYLOAD = struct.Struct('<q')  # lei_id (tambem usado por DROP e ANNOUNCED)
+
+class JournalFailed(RuntimeError):
+    """Raised by append/wait once the writer thread failed to write the journal."""
+
+def _record(kind, payload):
+    return HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+def encode_open(lei_id, lance_inic, nome, desc):
+    extra = json.dumps({'nome': nome, 'desc': desc}).encode()
+    return _record(OPEN, OPEN_PAYLOAD.pack(lei_id, lance_inic) + extra)
+
+def encode_bid(lei_id, cli_id, lance):
+    return _record(BID, BID_PAYLOAD.pack(lei_id, cli_id, lance))
+
+def encode_finalize(lei_id):
+    return _record(FINALIZE, FINALIZE_PAYLOAD.pack(lei_id))
+
+def encode_drop(lei_id):
+    return _record(DROP, FINALIZE_PAYLOAD.pack(lei_id))
+
+def encode_announced(lei_id):
+    return _record(ANNOUNCED, FINALIZE_PAYLOAD.pack(lei_id))
+
+def _number(value):
+    # lances chegam do JSON como int ou float; mantem int quando nao ha parte decimal
+    return int(value) if float(value).is_integer() else value
+
+def apply_record(states, kind, payload):
+    if kind == OPEN:
+        lei_id, lance_inic = OPEN_PAYLOAD.unpack_from(payload)
+        extra = json.loads(payload[OPEN_PAYLOAD.size:])
+        states[lei_id] = motorLances.AuctionState(lei_id, _number(lance_inic), extra['nome'], extra['desc'])
+    elif kind == BID:
+        lei_id, cli_id, lance = BID_PAYLOAD.unpack(payload)
+        state = states.get(lei_id)
+        if state is not None:
+            state.cli_id = cli_id
+            state.lance = _number(lance)
+    elif kind == FINALIZE:
+        (lei_id,) = FINALIZE_PAYLOAD.unpack(payload)
+        state = states.get(lei_id)
+        if state is not None:
+            state.status = motorLances.FINALIZADO
+    elif kind == DROP:
+        (lei_id,) = FINALIZE_PAYLOAD.unpack(payload)
+        states.pop(lei_id, None)
+    elif kind == ANNOUNCED:
+        (lei_id,) = FINALIZE_PAYLOAD.unpack(payload)
+        state = states.get(lei_id)
+        if state is not None:
+            state.anunciado = True
+
+def read_records(path):
+    # devolve (registros validos, bytes validos); para no primeiro registro incompleto
+    records = []
+    valid = 0
+    if not os.path.exists(path):
+        return records, valid
+    with open(path, 'rb') as f:
+        data = f.read()
+    while valid + HEADER.size <= len(data):
+        kind, length, crc = HEADER.unpack_from(data, valid)
+        start = valid + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        records.append((kind, payload))
+        valid = start + length
+    return records, valid
+
+def read_records_from_bytes(data):
+    offset = 0
+    while offset < len(data):
+        kind, length, _ = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        yield kind, data[start:start + length]
+        offset = start + length
+
+def encode_state(state):
+    records = [encode_open(state.lei_id, state.lance, state.nome, state.desc)]
+    if state.cli_id is not None:
+        records.append(encode_bid(state.lei_id, state.cli_id, state.lance))
+    if state.status == motorLances.FINALIZADO:
+        records.append(encode_finalize(state.lei_id))
+    if state.anunciado:
+        records.append(encode_announced(state.lei_id))
+    return b''.join(records)
+
+class BidJournal:
+    def __init__(self, journal_path=JOURNAL_PATH, snapshot_path=SNAPSHOT_PATH, durable=True):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.durable = durable
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.committed_cond = threading.Condition()
+        self.appended = 0
+        self.committed = 0
+        self.mirror = {}
+        self.records_in_journal = 0
+        self.file = None
+        self.failed = None
+        self.thread = threading.Thread(target=self._run, daemon=True, name='diario-lances')
+
+    def recover(self):
+        """Rebuilds per-auction state from the snapshot plus the journal tail."""
+        states = {}
+        for kind, payload in read_records(self.snapshot_path)[0]:
+            apply_record(states, kind, payload)
+        records, valid = read_records(self.journal_path)
+        for kind, payload in records:
+            apply_record(states, kind, payload)
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) != valid:
+            print(f"Descartando cauda corrompida do diario de lances apos {valid} bytes")
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valid)
+        self.mirror = states
+        self.records_in_journal = len(records)
+        return states
+
+    def start(self):
+        self.file = open(self.journal_path, 'ab')
+        self.thread.start()
+        return self
+
+    def append(self, record, on_durable=None):
+        # chamado com o lock do leilao seguro, entao a ordem do diario e a ordem das decisoes.
+        # record vazio (b'') nao grava nada, so ordena o callback atras dos anteriores
+        with self.lock:
+            if self.failed is not None:
+                raise JournalFailed(f"Diario de lances falhou: {self.failed}")
+            self.appended += 1
+            seq = self.appended
+            self.pending.put((record, on_durable))
+        return seq
+
+    def wait(self, seq, timeout=None):
+        with self.committed_cond:
+            done = self.committed_cond.wait_for(lambda: self.committed >= seq or self.failed is not None, timeout)
+            if self.committed < seq and self.failed is not None:
+                raise JournalFailed(f"Diario de lances falhou: {self.failed}")
+            return done
+
+    def flush(self, timeout=None):
+        # espera tudo o que ja foi anexado chegar ao disco
+        return self.wait(self.appended, timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            data = b''.join(record for record, _ in batch)
+            try:
+                self.file.write(data)
+                self.file.flush()
+                if self.durable:
+                    os.fsync(self.file.fileno())
+            except OSError as e:
+                self._fail(e)
+                return
+
+            for kind, payload in read_records_from_bytes(data):
+                apply_record(self.mirror, kind, payload)
+            self.records_in_journal += sum(1 for record, _ in batch if record)
+
+            with self.committed_cond:
+                self.committed += len(batch)
+                self.committed_cond.notify_all()
+            for _, on_durable in batch:
+                if on_durable is not None:
+                    try:
+                        on_durable()
+                    except Exception as e:
+                        print(f"Erro no callback do diario de lances: {e!r}")
+
+            if self.records_in_journal >= SNAPSHOT_EVERY:
+                try:
+                    self._snapshot()
+                except OSError as e:
+                    self._fail(e)
+                    return
+
+    def _fail(self, error):
+        # o que esta na fila nao chegou ao disco: quem espera recebe JournalFailed
+        print(f"Falha ao gravar o diario de lances, recusando novas decisoes: {error!r}")
+        with self.lock, self.committed_cond:
+            self.failed = error
+            self.committed_cond.notify_all()
+
+    def _snapshot(self):
+        # leiloes finalizados e ja anunciados nao precisam mais ser recuperados
+        for lei_id in [lei_id for lei_id, state in self.mirror.items() if state.anunciado]:
+            del self.mirror[lei_id]
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(encode_state(state) for state in self.mirror.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # snapshot garantido em disco: o diario pode recomecar do zero
+        self.file.close()
+        self.file = open(self.journal_path, 'wb')
+        self.records_in_journal = 0
+
+def benchmark(threads=8, leiloes=100, lances=200000):
+    import random
+    import tempfile
+    import time
+
+    for durable in (False, True):
+        with tempfile.TemporaryDirectory() as pasta:
+            journal = BidJournal(os.path.join(pasta, 'lances.journal'), os.path.join(pasta, 'lances.snapshot'), durable)
+            journal.recover()
+            journal.start()
+            engine = motorLances.BidEngine()
+            for lei_id in range(leiloes):
+                engine.open(lei_id, 0, f'leilao {lei_id}', '',
+                            on_open=lambda state: journal.append(encode_open(state.lei_id, state.lance, state.nome, state.desc)))
+            journal.flush()
+
+            def lanca(cli_id):
+                rng = random.Random(cli_id)
+                for i in range(lances // threads):
+                    seq = None
+
+                    def aceita(state):
+                        nonlocal seq
+                        seq = journal.append(encode_bid(state.lei_id, state.cli_id, state.lance))
+
+                    engine.bid(rng.randrange(leiloes), cli_id, i * threads + cli_id + 1, on_accept=aceita)
+                    if seq is not None:
+                        journal.wait(seq)
+
+            workers = [threading.Thread(target=lanca, args=(cli_id,)) for cli_id in range(threads)]
+            inicio = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            taxa = lances / (time.perf_counter() - inicio)
+
+            estados = BidJournal(journal.journal_path, journal.snapshot_path).recover()
+            confere = all(
+                (estados[lei_id].cli_id, estados[lei_id].lance) == (state.cli_id, state.lance)
+                for lei_id, state in engine.leiloes.items()
+            )
+            print(f"{'com' if durable else 'sem'} fsync: {taxa:,.0f} lances/s ({threads} threads, "
+                  f"{leiloes} leiloes), recuperacao {'confere' if confere else 'DIVERGE'}")
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*(int(arg) for arg in sys.argv[1:4]))
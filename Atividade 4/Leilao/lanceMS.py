@@ -1,13 +1,26 @@
 import pika
-import json
+import sys
+import math
 import threading
+import requests
+import publicador
+import motorLances
+import diarioLances
+import anelHash
+import clienteHttp
+import codecMensagens
 
 # app.py
 from flask import Flask, request, jsonify
 app = Flask(__name__)
 
+# Uso: python lanceMS.py [NOME_SHARD] [PORTA]
+# cada instancia e dona dos leiloes que o anel de hash consistente atribui a ela
+SHARD = sys.argv[1] if len(sys.argv) > 1 else 'lance0'
+PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 5002
+
 def runFlaskApp():
-    app.run(port=5002, debug=True, use_reloader=False)
+    app.run(port=PORT, debug=True, use_reloader=False)
 
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'leilao_exchange'
@@ -19,95 +32,237 @@ ROUTING_KEY_LANCE_INVALIDADO = 'lance_invalidado'
 ROUTING_KEY_LANCE_VALIDADO = 'lance_validado'
 ROUTING_KEY_LEILAO_VENCEDOR = 'leilao_vencedor'
 
-# chave eh o id do leilao
-ultimos_lances_validos = {}
-rabbitmq_objects = {}
+# estado por leilao (chave eh o id do leilao), seguro para as threads do Flask e do consumidor
+ultimos_lances_validos = motorLances.BidEngine()
+
+# diario de lances: com DIARIO_DURAVEL, cada lote de decisoes passa por um fsync antes
+# de ser publicado; False troca durabilidade em queda de energia por vazao
+DIARIO_DURAVEL = True
+DIARIO_TIMEOUT = 5.0
+diario = diarioLances.BidJournal(f'lances-{SHARD}.journal', f'lances-{SHARD}.snapshot', durable=DIARIO_DURAVEL)
+
+# topologia atual dos shards; trocada inteira em /topologia
+anel = anelHash.load()
+
+# formato das mensagens de lance publicadas; consumidores decodificam pelo content_type
+FORMATO_MENSAGENS = codecMensagens.BINARIO
+
+def publica(routing_key, json_data, on_confirm=None):
+    body, content_type = codecMensagens.encode(routing_key, json_data, FORMATO_MENSAGENS)
+    publisher.publish(routing_key, body, codecMensagens.propriedades(content_type), on_confirm)
+
+# conexao unica e thread-safe para publicar a partir das rotas Flask e do consumidor
+publisher = publicador.Publisher(RABBITMQ_HOST, EXCHANGE_NAME, EXCHANGE_TYPE)
+
+# filas proprias do shard: leilaoMS publica inicio/fim tambem com a routing key do dono
+QUEUE_LEILAO_INICIADO = anelHash.routing_key(ROUTING_KEY_LEILAO_INICIADO, SHARD)
+QUEUE_LEILAO_FINALIZADO = anelHash.routing_key(ROUTING_KEY_LEILAO_FINALIZADO, SHARD)
 
 # Routing keys
 QUEUE_BINDINGS = [
     (ROUTING_KEY_LANCE_INVALIDADO, ROUTING_KEY_LANCE_INVALIDADO),
-    (ROUTING_KEY_LEILAO_INICIADO, ROUTING_KEY_LEILAO_INICIADO),
-    (ROUTING_KEY_LEILAO_FINALIZADO, ROUTING_KEY_LEILAO_FINALIZADO)
+    (QUEUE_LEILAO_INICIADO, QUEUE_LEILAO_INICIADO),
+    (QUEUE_LEILAO_FINALIZADO, QUEUE_LEILAO_FINALIZADO)
 ]
 
+def nao_sou_dono(lei_id):
+    # 409 com a topologia atual, para o gateway atualizar o anel e reenviar
+    dono = anel.owner(lei_id)
+    return {"error": "Leilão pertence a outro shard", "shard": dono, "topologia": anel.topologia()}, 409
+
+def _inteiro(valor):
+    # int, ou texto/float com um inteiro (ex.: "30"); bool nao conta
+    if isinstance(valor, bool):
+        raise ValueError(valor)
+    if isinstance(valor, float):
+        if not valor.is_integer():
+            raise ValueError(valor)
+        return int(valor)
+    return int(valor)
+
+def _numero(valor):
+    if isinstance(valor, bool):
+        raise ValueError(valor)
+    valor = float(valor)
+    if not math.isfinite(valor):
+        raise ValueError(valor)
+    return int(valor) if valor.is_integer() else valor
+
+def _valida_lance(json_data):
+    # converte lei_id/cli_id/lance para os tipos do diario; devolve a mensagem de erro, ou None
+    if not isinstance(json_data, dict):
+        return "Lance deve ser um objeto JSON"
+    if "lei_id" not in json_data or "cli_id" not in json_data or "lance" not in json_data:
+        return "Campos faltando na requisicao"
+    try:
+        json_data['lei_id'] = _inteiro(json_data['lei_id'])
+        json_data['cli_id'] = _inteiro(json_data['cli_id'])
+        json_data['lance'] = _numero(json_data['lance'])
+    except (TypeError, ValueError):
+        return "lei_id e cli_id devem ser inteiros e lance um numero"
+    if not all(-2**63 <= json_data[campo] < 2**63 for campo in ('lei_id', 'cli_id')):
+        return "lei_id e cli_id fora do intervalo"
+    return None
+
 @app.post("/lance")
 def process_lance():
-    json_data = request.get_json()
-    
+    json_data = request.get_json(silent=True)
+    erro = _valida_lance(json_data)
+    if erro is not None:
+        return {"error": erro}, 400
+    if anel.owner(json_data['lei_id']) != SHARD:
+        return nao_sou_dono(json_data['lei_id'])
+    seq = None
+
+    # decide e anexa ao diario com o lock do leilao seguro; o diario publica depois do
+    # fsync, na ordem das decisoes (recusas passam pela mesma fila, sem gravar nada)
+    def aceita(state):
+        nonlocal seq
+        seq = diario.append(
+            diarioLances.encode_bid(state.lei_id, state.cli_id, state.lance),
+            on_durable=lambda: publica(ROUTING_KEY_LANCE_VALIDADO, json_data),
+        )
+
+    def recusa(state):
+        diario.append(b'', on_durable=lambda: publica(ROUTING_KEY_LANCE_INVALIDADO, json_data))
+
+    try:
+        resultado = ultimos_lances_validos.bid(
+            json_data['lei_id'], json_data['cli_id'], json_data['lance'],
+            on_accept=aceita, on_reject=recusa,
+        )
+        # so confirma ao cliente depois que o lance esta no diario
+        if resultado == motorLances.ACEITO and not diario.wait(seq, DIARIO_TIMEOUT):
+            return {"error": "Diário de lances indisponível"}, 503
+    except diarioLances.JournalFailed as e:
+        print(e)
+        return {"error": "Diário de lances indisponível"}, 503
+
     # se leilao nao existe, ignora
-    if json_data['lei_id'] not in ultimos_lances_validos:
+    if resultado == motorLances.INEXISTENTE:
         print(f"Leilão não existe: {json_data['lei_id']}")
         return {"error": "Leilão não existe"}, 400
-    
-    ch = rabbitmq_objects[json_data['lei_id']]['channel']
 
     # se foi lance valido
-    if int(json_data['lance']) > int(ultimos_lances_validos[json_data['lei_id']]['lance']) and ultimos_lances_validos[json_data['lei_id']]['status'] == 'ativo':
-        # atualiza ultimo lances validos do respectivo leilao
-        ultimos_lances_validos[json_data['lei_id']]['lance'] = json_data['lance']
-        ultimos_lances_validos[json_data['lei_id']]['cli_id'] = json_data['cli_id']
-        # publica o lance validado
-        ch.basic_publish(
-            exchange=EXCHANGE_NAME,
-            routing_key=ROUTING_KEY_LANCE_VALIDADO,
-            body=json.dumps(json_data)
-        )
+    if resultado == motorLances.ACEITO:
         print(f"Lance validado: {json_data}")
         return {"message": "Lance validado"}, 200
-    
+
     # se nao, lance invalido
-    else:
-        ch.basic_publish(
-            exchange=EXCHANGE_NAME,
-            routing_key=ROUTING_KEY_LANCE_INVALIDADO,
-            body=json.dumps(json_data)
-        )
-        print(f"Ignorando lance invalido")
-        return {"error": "Lance inválido"}, 400
+    print(f"Ignorando lance invalido")
+    return {"error": "Lance inválido"}, 400
+
+@app.post("/topologia")
+def process_topologia():
+    global anel
+    novo = anelHash.HashRing(request.get_json())
+    if novo.versao <= anel.versao:
+        return {"movidos": 0}, 200
+    anel = novo
+
+    # repassa os leiloes ativos que mudaram de dono; os demais ficam onde estao
+    destinos = {}
+    for lei_id in list(ultimos_lances_validos.leiloes):
+        dono = anel.owner(lei_id)
+        if dono != SHARD:
+            destinos.setdefault(dono, []).append(lei_id)
+    movidos = 0
+    for dono, lei_ids in destinos.items():
+        try:
+            estados = ultimos_lances_validos.export(
+                lei_ids, on_export=lambda state: diario.append(diarioLances.encode_drop(state.lei_id)),
+            )
+        except diarioLances.JournalFailed as e:
+            print(e)
+            return {"error": "Diário de lances indisponível"}, 503
+        try:
+            clienteHttp.post(f"{anel.shards[dono]}/importar", json=[state.as_dict() for state in estados]).raise_for_status()
+        except requests.RequestException as e:
+            # devolve os leiloes para este motor e deixa o operador tentar de novo
+            print(f"Erro ao repassar {len(estados)} leiloes para {dono}: {e}")
+            importa_estados(estados)
+            return {"error": f"Falha ao repassar leiloes para {dono}"}, 503
+        movidos += len(estados)
+    diario.flush(timeout=DIARIO_TIMEOUT)
+    print(f"Topologia versao {anel.versao}: {movidos} leiloes repassados")
+    return {"movidos": movidos}, 200
+
+def importa_estados(estados):
+    ultimos_lances_validos.restore({state.lei_id: state for state in estados})
+    for state in estados:
+        diario.append(diarioLances.encode_state(state))
+
+@app.post("/importar")
+def process_importar():
+    # leiloes ativos recebidos de outro shard durante um rebalanceamento
+    estados = []
+    for item in request.get_json():
+        state = motorLances.AuctionState(item['lei_id'], item['lance'], item['nome'], item['desc'])
+        state.cli_id = item['cli_id']
+        estados.append(state)
+    try:
+        importa_estados(estados)
+        if not diario.flush(timeout=DIARIO_TIMEOUT):
+            return {"error": "Diário de lances indisponível"}, 503
+    except diarioLances.JournalFailed as e:
+        print(e)
+        return {"error": "Diário de lances indisponível"}, 503
+    print(f"{len(estados)} leiloes importados")
+    return {"importados": len(estados)}, 200
+
+def repassa_se_nao_for_dono(routing_key, lei_id, properties, body):
+    # mensagem que chegou pela topologia antiga: reenvia para a fila do dono atual, no mesmo formato
+    dono = anel.owner(lei_id)
+    if dono == SHARD:
+        return False
+    publisher.publish(anelHash.routing_key(routing_key, dono), body, properties)
+    print(f"Leilão {lei_id} repassado para {dono}")
+    return True
 
 def process_leilao_iniciado(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
+    if repassa_se_nao_for_dono(ROUTING_KEY_LEILAO_INICIADO, json_data['lei_id'], properties, body):
+        return
     print(f"Leilao iniciado: {json_data['lei_id']}")
 
-    # cria canal para publicar mensagens
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=EXCHANGE_TYPE)
-
     # inicializa o leilão
-    ultimos_lances_validos[json_data['lei_id']] = {
-        'cli_id': None,
-        'lance': json_data['lance_inic'],
-        'nome': json_data['nome'],
-        'desc': json_data['desc'],
-        'status': 'ativo'
-    }
-    rabbitmq_objects[json_data['lei_id']] = {
-        'channel': channel,
-        'connection': connection
-    }
-    print(ultimos_lances_validos[json_data['lei_id']])
+    state = ultimos_lances_validos.open(
+        json_data['lei_id'], json_data['lance_inic'], json_data['nome'], json_data['desc'],
+        on_open=lambda state: diario.append(diarioLances.encode_open(state.lei_id, state.lance, state.nome, state.desc)),
+    )
+    print(state.as_dict())
+
+def marca_anunciado(lei_id):
+    # roda na thread do publicador quando o broker confirma o leilao_vencedor
+    try:
+        diario.append(diarioLances.encode_announced(lei_id))
+    except diarioLances.JournalFailed:
+        pass  # sem a marca, o vencedor e anunciado de novo na proxima partida
+
+def anuncia_vencedor(json_data, state):
+    json_data['cli_id'] = state.cli_id
+    json_data['lance'] = state.lance
+    json_data['desc'] = state.desc
+    json_data['nome'] = state.nome
+    publica(ROUTING_KEY_LEILAO_VENCEDOR, json_data, on_confirm=lambda: marca_anunciado(state.lei_id))
 
 def process_leilao_finalizado(ch, method, properties, body):
-    json_data = json.loads(body)
-    ultimos_lances_validos[json_data['lei_id']]['status'] = 'finalizado'
-
-    json_data['cli_id'] = ultimos_lances_validos[json_data['lei_id']]['cli_id']
-    json_data['lance'] = ultimos_lances_validos[json_data['lei_id']]['lance']
-    json_data['desc'] = ultimos_lances_validos[json_data['lei_id']]['desc']
-    json_data['nome'] = ultimos_lances_validos[json_data['lei_id']]['nome']
-    message = json.dumps(json_data)
-
-    ch.basic_publish(
-        exchange=EXCHANGE_NAME,
-        routing_key=ROUTING_KEY_LEILAO_VENCEDOR,
-        body=message
-    )
+    json_data = codecMensagens.decode_mensagem(properties, body)
+    if repassa_se_nao_for_dono(ROUTING_KEY_LEILAO_FINALIZADO, json_data['lei_id'], properties, body):
+        return
 
-    # rabbitmq_objects[json_data['lei_id']]['channel'].close()
-    # rabbitmq_objects[json_data['lei_id']]['connection'].close()
+    def publica_vencedor(state):
+        diario.append(
+            diarioLances.encode_finalize(state.lei_id),
+            on_durable=lambda: anuncia_vencedor(json_data, state),
+        )
 
-    print(f"Leilão finalizado: {message}")
+    # nenhum lance e aceito depois dessa transicao
+    if ultimos_lances_validos.finalize(json_data['lei_id'], on_finalize=publica_vencedor) is None:
+        print(f"Leilão desconhecido ou ja finalizado: {json_data['lei_id']}")
+        return
+
+    print(f"Leilão finalizado: {json_data}")
 
 def main():
     # abre conexao e exchange para publicar mensagens
@@ -120,9 +275,21 @@ def main():
         channel.queue_declare(queue=queue_name)
         channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=routing_key)
 
-    channel.basic_consume(queue='leilao_iniciado', on_message_callback=process_leilao_iniciado, auto_ack=True)
-    channel.basic_consume(queue='leilao_finalizado', on_message_callback=process_leilao_finalizado, auto_ack=True)
+    channel.basic_consume(queue=QUEUE_LEILAO_INICIADO, on_message_callback=process_leilao_iniciado, auto_ack=True)
+    channel.basic_consume(queue=QUEUE_LEILAO_FINALIZADO, on_message_callback=process_leilao_finalizado, auto_ack=True)
+
+    # reconstroi os lances de topo a partir do snapshot + cauda do diario
+    estados = diario.recover()
+    ultimos_lances_validos.restore(estados)
+    print(f"Shard {SHARD}: {len(estados)} leiloes recuperados do diario de lances")
+    diario.start()
 
+    publisher.start()
+    # finalizados cujo leilao_vencedor nao chegou a ser confirmado antes da queda
+    for state in estados.values():
+        if state.status == motorLances.FINALIZADO and not state.anunciado:
+            print(f"Anunciando de novo o vencedor do leilão {state.lei_id}")
+            anuncia_vencedor({'lei_id': state.lei_id}, state)
     threading.Thread(target=runFlaskApp, daemon=True).start()
 
     print("Esperando mensagens de leilao ou lances...")
@@ -130,6 +297,13 @@ def main():
         channel.start_consuming()
     except (KeyboardInterrupt, EOFError):
         channel.stop_consuming()
+    except diarioLances.JournalFailed as e:
+        # inicio/fim de leilao sem diario: encerra em vez de seguir com estado fora do disco
+        print(f"Encerrando: {e}")
+        sys.exit(1)
+    diario.flush(timeout=DIARIO_TIMEOUT)
+    publisher.flush(timeout=5)
+    publisher.stop()
     connection.close()
 
 if __name__ == '__main__':
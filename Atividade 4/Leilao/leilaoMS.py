@@ -1,8 +1,13 @@
-import pika
 import json
-import schedule
+import math
 import time
 import threading
+import publicador
+import agendador
+import catalogoLeiloes
+import armazemLeiloes
+import anelHash
+import codecMensagens
 
 # app.py
 from flask import Flask, request, jsonify
@@ -11,71 +16,133 @@ app = Flask(__name__)
 def runFlaskApp():
     app.run(port=5001, debug=True, use_reloader=False)
 
-def _find_next_id():
-    if not leiloes:
-        return 0
-    return max(leilao["lei_id"] for leilao in leiloes) + 1
+MAX_LIMIT = 1000
+
+def _parse_float(value):
+    return None if value is None else float(value)
 
 @app.get("/consultar_leiloes")
 def consultar_leiloes():
-    body = []
-    for leilao in leiloes:
-        atual = time.time()
-        if atual < leilao['data_inic']:
-            status = 'agendado'
-        elif leilao['data_inic'] <= atual < leilao['data_fim']:
-            status = 'em andamento'
-        else:
-            status = 'finalizado'
-        body.append({
-            'lei_id': leilao['lei_id'],
-            'nome': leilao['nome'],
-            'desc': leilao['desc'],
-            'lance_inic': leilao['lance_inic'],
-            'data_inic': leilao['data_inic'],
-            'data_fim': leilao['data_fim'],
-            'status': status,
-        })
-    return jsonify(body), 200
+    # filtros opcionais: status, janela [desde, ate) sobre a data de referencia
+    # (inicio para agendados, fim para os demais), limit e cursor para paginar
+    status = request.args.get('status')
+    if status is not None and status not in catalogoLeiloes.STATUS:
+        return {"error": f"status deve ser um de {list(catalogoLeiloes.STATUS)}"}, 400
+    try:
+        desde = _parse_float(request.args.get('desde'))
+        ate = _parse_float(request.args.get('ate'))
+        limit = request.args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(limit)
+        fragments, proximo_cursor = leiloes.query(status, desde, ate, limit, request.args.get('cursor'))
+    except ValueError:
+        return {"error": "Parametros de consulta invalidos"}, 400
+
+    # junta os fragmentos JSON ja serializados de cada leilao
+    response = app.response_class('[' + ','.join(fragments) + ']', status=200, mimetype='application/json')
+    if proximo_cursor is not None:
+        response.headers['X-Proximo-Cursor'] = proximo_cursor
+    return response
+
+# limite para datas (segundos epoch, ~ano 5138) e lance inicial
+VALOR_MAXIMO = 10 ** 11
+
+def _valida_leilao(novo_leilao, atual):
+    # devolve a mensagem de erro, ou None se o leilao e valido
+    if not isinstance(novo_leilao, dict):
+        return "Leilao deve ser um objeto JSON"
+    if "desc" not in novo_leilao or "data_inic" not in novo_leilao or "data_fim" not in novo_leilao or "nome" not in novo_leilao or "lance_inic" not in novo_leilao:
+        return "Campos faltando na requisicao"
+    for campo in ("data_inic", "data_fim", "lance_inic"):
+        if not isinstance(novo_leilao[campo], (int, float)) or isinstance(novo_leilao[campo], bool):
+            return f"{campo} deve ser um numero"
+        # o JSON do Flask aceita Infinity/NaN; valores enormes tambem nao cabem no agendador
+        if not math.isfinite(novo_leilao[campo]) or not 0 <= novo_leilao[campo] <= VALOR_MAXIMO:
+            return f"{campo} deve ser um numero entre 0 e {VALOR_MAXIMO}"
+    for campo in ("nome", "desc"):
+        if not isinstance(novo_leilao[campo], str):
+            return f"{campo} deve ser texto"
+    if novo_leilao["data_inic"] >= novo_leilao["data_fim"]:
+        return "data_inic deve ser anterior a data_fim"
+    if novo_leilao["data_inic"] <= atual:
+        return "data_inic deve ser posterior ao tempo atual"
+    return None
 
 @app.post("/criar_leilao")
 def criar_leilao():
-    # abre conexao e exchange para publicar mensagens
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct')
-
     if request.is_json:
         novo_leilao = request.get_json()
         atual = time.time()
 
         # valida campos obrigatorios
-        if "desc" not in novo_leilao or "data_inic" not in novo_leilao or "data_fim" not in novo_leilao or "nome" not in novo_leilao or "lance_inic" not in novo_leilao:
-            return {"error": "Campos faltando na requisicao"}, 400
-        if novo_leilao["data_inic"] >= novo_leilao["data_fim"]:
-            return {"error": "data_inic deve ser anterior a data_fim"}, 400
-        if novo_leilao["data_inic"] <= time.time():
-            return {"error": "data_inic deve ser posterior ao tempo atual"}, 400
+        erro = _valida_leilao(novo_leilao, atual)
+        if erro is not None:
+            return {"error": erro}, 400
 
         # atribui id unico
-        novo_leilao["lei_id"] = _find_next_id()
+        novo_leilao["lei_id"] = leiloes.allocate_ids()
 
-        # adiciona leilao a lista e agenda inicio/fim
-        leiloes.append(novo_leilao)
-        espera_inic = novo_leilao['data_inic'] - atual
-        espera_fim = novo_leilao['data_fim'] - atual
-        schedule.every(espera_inic).seconds.do(leilao_agendado, evento=INICIAR, lei_id=novo_leilao['lei_id'], channel=channel, connection=connection)
-        print(f"inicio de {novo_leilao['lei_id']} agendado para daqui {espera_inic}s")
-        schedule.every(espera_fim).seconds.do(leilao_agendado, evento=FINALIZAR, lei_id=novo_leilao['lei_id'], channel=channel, connection=connection)
-        print(f"fim de {novo_leilao['lei_id']} agendado para daqui {espera_fim}s")
+        # adiciona leilao ao catalogo, grava e agenda inicio/fim
+        leiloes.add(novo_leilao)
+        store.save(novo_leilao, catalogoLeiloes.AGENDADO)
+        agenda_leilao(novo_leilao, atual)
+        anuncia_criados([novo_leilao])
 
         return novo_leilao, 201
     return {"error": "Request must be JSON"}, 415
 
+def _le_lote():
+    # aceita um array JSON ou NDJSON (um leilao por linha), lido linha a linha do corpo
+    if request.mimetype == 'application/x-ndjson':
+        return [json.loads(line) for line in request.stream if line.strip()]
+    if request.is_json:
+        lote = request.get_json()
+        if isinstance(lote, list):
+            return lote
+    return None
+
+@app.post("/criar_leiloes")
+def criar_leiloes():
+    try:
+        lote = _le_lote()
+    except ValueError:
+        return {"error": "NDJSON invalido"}, 400
+    if lote is None:
+        return {"error": "Request must be a JSON array or NDJSON"}, 415
+
+    # valida tudo em uma passada
+    atual = time.time()
+    erros = [_valida_leilao(novo_leilao, atual) for novo_leilao in lote]
+    validos = [novo_leilao for novo_leilao, erro in zip(lote, erros) if erro is None]
+
+    # um bloco de ids, uma insercao no catalogo, uma gravacao e um agendamento para o lote
+    primeiro_id = leiloes.allocate_ids(len(validos))
+    for offset, novo_leilao in enumerate(validos):
+        novo_leilao["lei_id"] = primeiro_id + offset
+    leiloes.add_many(validos)
+    store.save_many(validos, catalogoLeiloes.AGENDADO)
+    scheduler.schedule_many(
+        evento
+        for novo_leilao in validos
+        for evento in ((novo_leilao['lei_id'], INICIAR, novo_leilao['data_inic']),
+                       (novo_leilao['lei_id'], FINALIZAR, novo_leilao['data_fim']))
+    )
+    anuncia_criados(validos)
+    print(f"{len(validos)} de {len(lote)} leiloes criados em lote")
+
+    resultados = []
+    for index, (novo_leilao, erro) in enumerate(zip(lote, erros)):
+        if erro is None:
+            resultados.append({"index": index, "status": 201, "leilao": novo_leilao})
+        else:
+            resultados.append({"index": index, "status": 400, "error": erro})
+    return jsonify(resultados), 200
+
 RABBITMQ_HOST = 'localhost'
 EXCHANGE_NAME = 'leilao_exchange'
 ROUTING_KEY_LEILAO_INICIADO = 'leilao_iniciado'
 ROUTING_KEY_LEILAO_FINALIZADO = 'leilao_finalizado'
+ROUTING_KEY_LEILAO_CRIADO = 'leilao_criado'
 
 
 # leilao 0 dura 30 segundos e comeca 5 segundos depois do inicio do script
@@ -85,66 +152,108 @@ LEI_0_FIM = LEI_0_INIC + 5
 INICIAR = 1
 FINALIZAR = 0
 
-def leilao_agendado(evento, lei_id, channel, connection):
+# conexao unica e reaproveitada para publicar inicio/fim de todos os leiloes
+publisher = publicador.Publisher(RABBITMQ_HOST, EXCHANGE_NAME, 'direct')
+
+# shards do lanceMS: inicio/fim tambem vao para a fila do shard dono do leilao
+anel = anelHash.load()
+
+@app.post('/topologia')
+def topologia():
+    global anel
+    novo = anelHash.HashRing(request.get_json())
+    if novo.versao > anel.versao:
+        anel = novo
+    return {"versao": anel.versao}, 200
+
+def agenda_leilao(leilao, atual):
+    scheduler.schedule(leilao['lei_id'], INICIAR, leilao['data_inic'])
+    print(f"inicio de {leilao['lei_id']} agendado para daqui {leilao['data_inic'] - atual}s")
+    scheduler.schedule(leilao['lei_id'], FINALIZAR, leilao['data_fim'])
+    print(f"fim de {leilao['lei_id']} agendado para daqui {leilao['data_fim'] - atual}s")
+
+def anuncia_criados(novos_leiloes):
+    # todos os gateways (cada shard tem seu cache do catalogo) passam a listar os leiloes
+    for novo_leilao in novos_leiloes:
+        message, content_type = codecMensagens.encode(ROUTING_KEY_LEILAO_CRIADO, {
+            field: novo_leilao[field] for field in ('lei_id', 'nome', 'desc', 'lance_inic', 'data_inic', 'data_fim')
+        })
+        publisher.publish(ROUTING_KEY_LEILAO_CRIADO, message, codecMensagens.propriedades(content_type))
+
+def leiloes_agendados(evento, lei_ids):
+    # todos os leiloes com o mesmo prazo chegam juntos
+    for lei_id in lei_ids:
+        leilao_agendado(evento, lei_id)
+
+def leilao_agendado(evento, lei_id):
     if evento == INICIAR:
         routing_key = ROUTING_KEY_LEILAO_INICIADO
     elif evento == FINALIZAR:
         routing_key = ROUTING_KEY_LEILAO_FINALIZADO
         
-    message = json.dumps({
-        'lei_id': leiloes[lei_id]['lei_id'],
-        'nome': leiloes[lei_id]['nome'],
-        'desc': leiloes[lei_id]['desc'],
-        'lance_inic': leiloes[lei_id]['lance_inic'],
-        'data_inic': leiloes[lei_id]['data_inic'],
-        'data_fim': leiloes[lei_id]['data_fim'],
+    leilao = leiloes.get(lei_id)
+    message, content_type = codecMensagens.encode(routing_key, {
+        'lei_id': leilao['lei_id'],
+        'nome': leilao['nome'],
+        'desc': leilao['desc'],
+        'lance_inic': leilao['lance_inic'],
+        'data_inic': leilao['data_inic'],
+        'data_fim': leilao['data_fim'],
     })
-    channel.basic_publish(
-       exchange=EXCHANGE_NAME,
-       routing_key=routing_key,
-       body=message
-    )
+    # move o leilao de balde no catalogo e grava o novo estado
+    if evento == INICIAR:
+        leiloes.mark_started(lei_id)
+        store.set_status(lei_id, catalogoLeiloes.EM_ANDAMENTO)
+    elif evento == FINALIZAR:
+        leiloes.mark_finished(lei_id)
+        store.set_status(lei_id, catalogoLeiloes.FINALIZADO)
+    properties = codecMensagens.propriedades(content_type)
+    publisher.publish(routing_key, message, properties)
+    publisher.publish(anelHash.routing_key(routing_key, anel.owner(lei_id)), message, properties)
     if evento == INICIAR:
         print(f"Leilão iniciado: {lei_id}")
     elif evento == FINALIZAR:
-        channel.close()
-        connection.close()
         print(f"Leilão finalizado: {lei_id}")
-    
-    return schedule.CancelJob
 
-leiloes = [
-]
+# inicio/fim de leiloes disparados no prazo exato, em lotes por prazo
+scheduler = agendador.AuctionScheduler(on_due=leiloes_agendados)
+
+leiloes = catalogoLeiloes.AuctionCatalog()
+store = armazemLeiloes.AuctionStore(armazemLeiloes.DB_PATH)
+
+def reidrata_leiloes():
+    # recarrega os leiloes gravados e rearma inicio/fim pendentes; prazos que passaram
+    # enquanto o servico estava fora disparam assim que o agendador roda
+    inicio = time.time()
+    items = list(store.load_all())
+    leiloes.load(items)
+    eventos = []
+    for leilao, status in items:
+        if status == catalogoLeiloes.AGENDADO:
+            eventos.append((leilao['lei_id'], INICIAR, leilao['data_inic']))
+        if status != catalogoLeiloes.FINALIZADO:
+            eventos.append((leilao['lei_id'], FINALIZAR, leilao['data_fim']))
+    scheduler.schedule_many(eventos)
+    print(f"{len(items)} leiloes recarregados e {len(eventos)} eventos reagendados em {time.time() - inicio:.2f}s")
 
 def main():
     # abre conexao e exchange para publicar mensagens
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct')
+    publisher.start()
+    store.start()
+    reidrata_leiloes()
 
     threading.Thread(target=runFlaskApp, daemon=True).start()
 
-    for entry in leiloes:
-        atual = time.time()
-        espera_inic = entry['data_inic'] - atual
-        espera_fim = entry['data_fim'] - atual
-        schedule.every(espera_inic).seconds.do(leilao_agendado, evento=INICIAR, lei_id=entry['lei_id'], channel=channel, connection=connection)
-        print(f"inicio de {entry['lei_id']} agendado para daqui {espera_inic}s")
-        schedule.every(espera_fim).seconds.do(leilao_agendado, evento=FINALIZAR, lei_id=entry['lei_id'], channel=channel, connection=connection)
-        print(f"fim de {entry['lei_id']} agendado para daqui {espera_fim}s")
-
     print("[iniciar] [ID] [DESCRICAO] [DATA_INICIO] [DATA_FIM]")
 
-    while True:
-        try:
-            schedule.run_pending()   # executa jobs agendados
-            time.sleep(1)            # evita busy loop
-            
-        except (KeyboardInterrupt, EOFError):
-            print("\nSaindo. Agradeçemos pela preferência.")
-            break
+    try:
+        scheduler.run()   # dorme ate o proximo prazo e dispara os leiloes vencidos
+    except (KeyboardInterrupt, EOFError):
+        print("\nSaindo. Agradeçemos pela preferência.")
 
-    #connection.close()
+    store.flush()
+    publisher.flush(timeout=5)
+    publisher.stop()
 
 if __name__ == '__main__':
     main()
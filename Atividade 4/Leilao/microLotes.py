@@ -0,0 +1,75 @@
+# Micro-lotes: junta itens que chegam separados (mensagens do RabbitMQ, chamadas de
+# rotas) e entrega em lotes, quando o lote enche (max_items) ou quando o item mais antigo
+# esperou max_delay segundos, o que vier primeiro. Em rajadas o custo por chamada de
+# saida e dividido entre muitos itens; com trafego baixo cada item atrasa no maximo
+# max_delay.
+#
+# on_batch roda na thread do agrupador, na ordem de chegada; se for demorado, deve
+# repassar o lote para outra thread (ex.: um ThreadPoolExecutor).
+#
+# Uso:
+#     batcher = MicroBatcher(on_batch=lambda itens: ..., max_items=100, max_delay=0.005).start()
+#     batcher.add(item)
+
+import threading
+import time
+
+MAX_ITEMS = 100
+MAX_DELAY = 0.005  # segundos
+
+class MicroBatcher:
+    def __init__(self, on_batch, max_items=MAX_ITEMS, max_delay=MAX_DELAY, name='micro-lotes'):
+        self.on_batch = on_batch
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.items = []
+        self.first_at = None
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, daemon=True, name=name)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def add(self, item):
+        with self.cond:
+            if not self.items:
+                self.first_at = time.monotonic()
+                self.cond.notify()
+            self.items.append(item)
+            if len(self.items) >= self.max_items:
+                self.cond.notify()
+
+    def _take(self):
+        # espera o lote encher ou o prazo do item mais antigo vencer
+        with self.cond:
+            while not self.stopping:
+                if not self.items:
+                    self.cond.wait()
+                    continue
+                remaining = self.first_at + self.max_delay - time.monotonic()
+                if len(self.items) >= self.max_items or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = self.items[:self.max_items]
+            del self.items[:self.max_items]
+            # o que sobrou de um lote cheio comeca a contar agora
+            self.first_at = time.monotonic() if self.items else None
+            return batch
+
+    def _run(self):
+        while not self.stopping:
+            batch = self._take()
+            if batch:
+                self.on_batch(batch)
+
+    def stop(self):
+        # entrega o que estiver pendente antes de parar
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join(timeout=5)
+        if self.items:
+            batch, self.items = self.items, []
+            self.on_batch(batch)
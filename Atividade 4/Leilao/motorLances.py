@@ -0,0 +1,181 @@
+# Motor de lances do lanceMS.
+#
+# Guarda o estado de cada leilao em um registro compacto (__slots__) e protege as
+# operacoes com lock striping: o lei_id escolhe um de N locks, entao lances em leiloes
+# diferentes correm em paralelo nas threads do Flask, enquanto lances no mesmo leilao
+# e a finalizacao dele (vinda da thread do consumidor) sao serializados. O aceite ou
+# recusa de um lance e a transicao para finalizado sao atomicos: nenhum lance e aceito
+# depois que o vencedor foi decidido.
+#
+# Os callbacks on_open/on_accept/on_reject/on_finalize rodam com o lock do leilao seguro, para
+# que os eventos publicados saiam na mesma ordem das decisoes. Devem ser rapidos (por
+# exemplo, publicador.Publisher.publish apenas enfileira).
+#
+# python motorLances.py [THREADS] [LANCES] [LEILOES] dispara lances concorrentes com
+# finalizacoes no meio e confere que cada vencedor e o maior lance aceito.
+
+import threading
+
+LOCK_STRIPES = 64
+
+ATIVO = 'ativo'
+FINALIZADO = 'finalizado'
+
+# resultados de BidEngine.bid
+ACEITO = 'aceito'
+RECUSADO = 'recusado'
+INEXISTENTE = 'inexistente'
+
+class AuctionState:
+    __slots__ = ('lei_id', 'cli_id', 'lance', 'nome', 'desc', 'status', 'anunciado')
+
+    def __init__(self, lei_id, lance, nome, desc):
+        self.lei_id = lei_id
+        self.cli_id = None
+        self.lance = lance
+        self.nome = nome
+        self.desc = desc
+        self.status = ATIVO
+        self.anunciado = False  # leilao_vencedor ja confirmado (diarioLances.ANNOUNCED)
+
+    def as_dict(self):
+        return {
+            'lei_id': self.lei_id,
+            'cli_id': self.cli_id,
+            'lance': self.lance,
+            'nome': self.nome,
+            'desc': self.desc,
+            'status': self.status,
+        }
+
+class BidEngine:
+    def __init__(self, stripes=LOCK_STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.leiloes = {}
+
+    def _lock(self, lei_id):
+        return self.locks[hash(lei_id) % len(self.locks)]
+
+    def __contains__(self, lei_id):
+        return lei_id in self.leiloes
+
+    def get(self, lei_id):
+        return self.leiloes.get(lei_id)
+
+    def open(self, lei_id, lance_inic, nome, desc, on_open=None):
+        # inicio repetido (reenvio do publicador, reagendamento na reidratacao) nao zera o
+        # leilao: devolve o estado existente sem chamar on_open
+        with self._lock(lei_id):
+            state = self.leiloes.get(lei_id)
+            if state is not None:
+                return state
+            state = AuctionState(lei_id, lance_inic, nome, desc)
+            if on_open is not None:
+                on_open(state)
+            self.leiloes[lei_id] = state
+            return state
+
+    def restore(self, states):
+        # recarga na partida (ex.: diarioLances.BidJournal.recover), antes de aceitar lances
+        for lei_id, state in states.items():
+            with self._lock(lei_id):
+                self.leiloes[lei_id] = state
+
+    def export(self, lei_ids, on_export=None):
+        # retira leiloes ativos deste motor (rebalanceamento de shards) e devolve seus estados
+        exported = []
+        for lei_id in lei_ids:
+            with self._lock(lei_id):
+                state = self.leiloes.get(lei_id)
+                if state is None or state.status != ATIVO:
+                    continue
+                if on_export is not None:
+                    on_export(state)
+                del self.leiloes[lei_id]
+                exported.append(state)
+        return exported
+
+    def bid(self, lei_id, cli_id, lance, on_accept=None, on_reject=None):
+        with self._lock(lei_id):
+            state = self.leiloes.get(lei_id)
+            if state is None:
+                return INEXISTENTE
+            if state.status == ATIVO and int(lance) > int(state.lance):
+                anterior = state.lance, state.cli_id
+                state.lance = lance
+                state.cli_id = cli_id
+                if on_accept is not None:
+                    try:
+                        on_accept(state)
+                    except Exception:
+                        # lance nao registrado (ex.: falha ao gravar no diario): volta o vencedor anterior
+                        state.lance, state.cli_id = anterior
+                        raise
+                return ACEITO
+            if on_reject is not None:
+                on_reject(state)
+            return RECUSADO
+
+    def finalize(self, lei_id, on_finalize=None):
+        with self._lock(lei_id):
+            state = self.leiloes.get(lei_id)
+            if state is None or state.status == FINALIZADO:
+                return None
+            state.status = FINALIZADO
+            if on_finalize is not None:
+                try:
+                    on_finalize(state)
+                except Exception:
+                    state.status = ATIVO
+                    raise
+            return state
+
+def estresse(threads=16, lances=2000, leiloes=8):
+    # lances aleatorios de varias threads com finalizacoes concorrentes; confere que o
+    # vencedor de cada leilao e o maior lance aceito e que os aceitos so sobem
+    import random
+    import time
+
+    engine = BidEngine()
+    for lei_id in range(leiloes):
+        engine.open(lei_id, 0, f'leilao {lei_id}', '')
+    aceitos = {lei_id: [] for lei_id in range(leiloes)}
+    vencedores = {}
+    barreira = threading.Barrier(threads + 1)
+
+    def lanca(cli_id):
+        rng = random.Random(cli_id)
+        barreira.wait()
+        for i in range(lances):
+            lei_id = rng.randrange(leiloes)
+            # valores sobem aos poucos, entao as threads disputam o topo ate o fim
+            # on_accept roda com o lock do leilao, entao a lista fica na ordem das decisoes
+            engine.bid(lei_id, cli_id, rng.randrange(i * 10, i * 10 + 1000),
+                       on_accept=lambda state: aceitos[state.lei_id].append((state.lance, state.cli_id)))
+
+    def finaliza():
+        barreira.wait()
+        for lei_id in random.sample(range(leiloes), leiloes):
+            time.sleep(0.01)  # fecha um leilao por vez com os lances ainda chegando
+            engine.finalize(lei_id, on_finalize=lambda state: vencedores.__setitem__(state.lei_id, (state.lance, state.cli_id)))
+
+    workers = [threading.Thread(target=lanca, args=(cli_id,)) for cli_id in range(threads)]
+    workers.append(threading.Thread(target=finaliza))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    for lei_id in range(leiloes):
+        lista = aceitos[lei_id]
+        assert all(a[0] < b[0] for a, b in zip(lista, lista[1:])), f"leilao {lei_id}: lances aceitos fora de ordem"
+        esperado = lista[-1] if lista else (0, None)
+        assert vencedores[lei_id] == esperado, f"leilao {lei_id}: vencedor {vencedores[lei_id]}, esperado {esperado}"
+        assert engine.bid(lei_id, -1, 10**9) == RECUSADO, f"leilao {lei_id}: lance aceito depois de finalizado"
+    total = sum(len(lista) for lista in aceitos.values())
+    print(f"{threads} threads x {lances} lances em {leiloes} leiloes: {total} aceitos, vencedores conferem")
+
+if __name__ == '__main__':
+    # python motorLances.py [THREADS] [LANCES] [LEILOES] roda o teste de estresse
+    import sys
+    estresse(*(int(arg) for arg in sys.argv[1:4]))
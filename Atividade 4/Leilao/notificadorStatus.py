@@ -0,0 +1,118 @@
+# Fila de saida (outbox) dos webhooks de status de pagamento do sistemaPagamento.
+#
+# /pagar grava a notificacao em uma tabela SQLite e responde ao comprador; uma thread
+# separada le as notificacoes pendentes em ordem de chegada, envia em lote para o
+# pagamentoMS (/status_pagamentos) e so apaga o que foi entregue. Se o pagamentoMS
+# estiver fora, o mesmo lote e reenviado com backoff exponencial; como os lotes saem
+# sempre do inicio da fila, a ordem das notificacoes de um mesmo pagamento nunca inverte.
+# Notificacoes ainda nao entregues sobrevivem a um reinicio do processo.
+#
+# Uso:
+#     notificador = StatusNotifier(URL).start()
+#     notificador.enqueue({'lei_id': 1, 'cli_id': 2, 'status': 'aprovado'})
+
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+
+import clienteHttp
+
+DB_PATH = 'notificacoes.db'
+BATCH_SIZE = 100
+BATCH_DELAY = 0.005  # segundos esperando mais notificacoes antes de enviar
+BACKOFF_INICIAL = 0.5  # segundos, dobra a cada falha seguida
+BACKOFF_MAX = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notificacoes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    body TEXT NOT NULL
+)
+"""
+
+class StatusNotifier:
+    def __init__(self, url, path=DB_PATH):
+        self.url = url
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.stopping = False
+        # True enquanto pode haver notificacoes na tabela; comeca True para enviar o que
+        # ficou pendente de uma execucao anterior
+        self.dirty = True
+        self.thread = threading.Thread(target=self._run, daemon=True, name='notificador-status')
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def enqueue(self, body):
+        # gravado antes de retornar: a notificacao nao se perde se o processo cair
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO notificacoes (body) VALUES (?)", (json.dumps(body),))
+        with self.cond:
+            self.dirty = True
+            self.cond.notify()
+
+    def pending(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM notificacoes").fetchone()[0]
+
+    def _next_batch(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT id, body FROM notificacoes ORDER BY id LIMIT ?", (BATCH_SIZE,)
+            ).fetchall()
+
+    def _delete(self, last_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM notificacoes WHERE id <= ?", (last_id,))
+
+    def _send(self, rows):
+        response = clienteHttp.post(self.url, json=[json.loads(body) for _, body in rows])
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"{response.status_code} - {response.text}", response=response)
+        if response.status_code != 200:
+            # lote recusado (4xx): reenviar nao muda a resposta, descarta
+            print(f"Notificacoes recusadas pelo pagamentoMS: {response.status_code} - {response.text}")
+            return
+        for (_, body), resultado in zip(rows, response.json()):
+            if resultado['status'] != 200:
+                print(f"Notificacao descartada: {body} ({resultado.get('error')})")
+
+    def _run(self):
+        backoff = BACKOFF_INICIAL
+        while not self.stopping:
+            with self.cond:
+                self.cond.wait_for(lambda: self.dirty or self.stopping)
+                self.dirty = False
+            # espera um pouco para juntar mais notificacoes no mesmo lote
+            time.sleep(BATCH_DELAY)
+            while not self.stopping:
+                rows = self._next_batch()
+                if not rows:
+                    break
+                try:
+                    self._send(rows)
+                except Exception as e:
+                    # rede, 5xx ou resposta fora do formato: tudo volta para a fila, a thread nao pode morrer
+                    print(f"Erro ao notificar {len(rows)} status de pagamento ({e!r}), nova tentativa em {backoff}s")
+                    with self.cond:
+                        self.cond.wait_for(lambda: self.stopping, backoff)
+                    backoff = min(backoff * 2, BACKOFF_MAX)
+                    continue
+                backoff = BACKOFF_INICIAL
+                self._delete(rows[-1][0])
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        self.thread.join(timeout=5)
@@ -1,7 +1,12 @@
 import pika
-import json
+import functools
 import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+import clienteHttp
+import publicador
+import microLotes
+import codecMensagens
 
 # app.py
 from flask import Flask, request, jsonify
@@ -18,7 +23,35 @@ ROUTING_KEY_LEILAO_VENCEDOR = 'leilao_vencedor'
 ROUTING_KEY_LINK_PAGAMENTO = 'link_pagamento'
 ROUTING_KEY_STATUS_PAGAMENTO = 'status_pagamento'
 
-SISTEMA_PAGAMENTO_URL = 'http://127.0.0.1:5004/novo_pagamento'
+SISTEMA_PAGAMENTOS_URL = 'http://127.0.0.1:5004/novos_pagamentos'
+
+# pedidos de link rodam em um pool limitado, fora da thread do consumidor, para um
+# sistema de pagamento lento nao travar a fila nem o heartbeat do RabbitMQ
+WORKERS = 16
+PREFETCH = 1000  # vencedores entregues e ainda sem ack (limita o trabalho em voo)
+# vencedores sao agrupados por ate LOTE_JANELA segundos ou LOTE_MAX itens e pedidos em
+# uma unica chamada a /novos_pagamentos
+LOTE_MAX = 100
+LOTE_JANELA = 0.005
+MAX_TENTATIVAS = 5
+BACKOFF_INICIAL = 0.5  # segundos, dobra a cada tentativa
+
+executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='link-pagamento')
+
+# (lei_id, cli_id) -> link ja obtido: uma reentrega republica o mesmo link sem pedir outra cobranca
+links_pagamento = {}
+
+def envia_lote(itens):
+    executor.submit(tarefa_links, itens, 1)
+
+lote_vencedores = microLotes.MicroBatcher(envia_lote, LOTE_MAX, LOTE_JANELA, name='lote-vencedores')
+
+def publica(routing_key, body, on_confirm=None):
+    message, content_type = codecMensagens.encode(routing_key, body)
+    publisher.publish(routing_key, message, codecMensagens.propriedades(content_type), on_confirm=on_confirm)
+
+# conexao unica para publicar, usada tanto pelas rotas Flask quanto pelo consumidor
+publisher = publicador.Publisher(RABBITMQ_HOST, EXCHANGE_NAME, EXCHANGE_TYPE)
 
 @app.post("/status_pagamento")
 def process_status_pagamento():
@@ -33,45 +66,133 @@ def process_status_pagamento():
         'cli_id': json_data['cli_id'],
         'status': json_data['status']
     }
-    connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='direct')
-
-    channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=ROUTING_KEY_STATUS_PAGAMENTO, body=json.dumps(body))
+    publica(ROUTING_KEY_STATUS_PAGAMENTO, body)
     print(f"Status do pagamento publicado: {body}")
     return {"message": "Status do pagamento recebido"}, 200
 
+@app.post("/status_pagamentos")
+def process_status_pagamentos():
+    # lote de webhooks do sistemaPagamento, publicado na ordem recebida
+    json_data = request.get_json(silent=True)
+    if not isinstance(json_data, list):
+        return {"error": "Esperado um array de status"}, 400
+
+    resultados = []
+    for index, item in enumerate(json_data):
+        if not isinstance(item, dict) or "lei_id" not in item or "cli_id" not in item or "status" not in item:
+            resultados.append({"index": index, "status": 400, "error": "Campos faltando na requisicao"})
+            continue
+        publica(ROUTING_KEY_STATUS_PAGAMENTO, {
+            'lei_id': item['lei_id'],
+            'cli_id': item['cli_id'],
+            'status': item['status']
+        })
+        resultados.append({"index": index, "status": 200})
+    print(f"{len(json_data)} status de pagamento publicados")
+    return jsonify(resultados), 200
+
+def confirma(ch, delivery_tag):
+    # acks so podem sair pela thread da conexao do consumidor
+    ch.connection.add_callback_threadsafe(functools.partial(ch.basic_ack, delivery_tag))
+
+def devolve(ch, delivery_tag):
+    ch.connection.add_callback_threadsafe(functools.partial(ch.basic_nack, delivery_tag, requeue=True))
+
+def descarta(ch, delivery_tag):
+    ch.connection.add_callback_threadsafe(functools.partial(ch.basic_nack, delivery_tag, requeue=False))
+
 def process_leilao_vencedor(ch, method, properties, body):
-    json_data = json.loads(body)
+    json_data = codecMensagens.decode_mensagem(properties, body)
 
     if "cli_id" not in json_data or json_data['cli_id'] is None:
         print("Leilão finalizado sem lances válidos, nenhum pagamento necessário.")
+        ch.basic_ack(method.delivery_tag)
         return
 
+    lote_vencedores.add((ch, method.delivery_tag, json_data))
+
+def publica_link(ch, delivery_tag, json_data, link):
     body = {
+        'lei_id': json_data['lei_id'],
+        'cli_id': json_data['cli_id'],
+        'link_pagamento': link
+    }
+    # ack so depois que o broker confirmar o link publicado
+    publica(ROUTING_KEY_LINK_PAGAMENTO, body, on_confirm=lambda: confirma(ch, delivery_tag))
+    print(f"link de pagamento recebido: {body}")
+
+def tarefa_links(itens, tentativa):
+    # erro inesperado (resposta ou mensagem fora do formato) nao pode deixar entregas sem
+    # ack ate o canal cair: as que ainda nao tiveram destino sao descartadas
+    resolvidos = set()
+    try:
+        solicita_links(itens, tentativa, resolvidos)
+    except Exception as e:
+        restantes = [(ch, delivery_tag) for ch, delivery_tag, _ in itens if delivery_tag not in resolvidos]
+        print(f"Erro inesperado ao solicitar links, descartando {len(restantes)} vencedores: {e!r}")
+        for ch, delivery_tag in restantes:
+            descarta(ch, delivery_tag)
+
+def solicita_links(itens, tentativa, resolvidos):
+    # itens: lista de (ch, delivery_tag, json_data); os que ja tem link nao voltam ao sistema.
+    # resolvidos recebe o delivery_tag de cada item que ja teve ack, nack ou nova tentativa
+    pendentes = []
+    for ch, delivery_tag, json_data in itens:
+        link = links_pagamento.get((json_data['lei_id'], json_data['cli_id']))
+        if link is not None:
+            publica_link(ch, delivery_tag, json_data, link)
+            resolvidos.add(delivery_tag)
+        else:
+            pendentes.append((ch, delivery_tag, json_data))
+    if not pendentes:
+        return
+
+    body = [{
         "lei_id": json_data['lei_id'],
         "cli_id": json_data['cli_id'],
         "valor": json_data['lance'],
         "moeda": "BRL"
-    }
-    print(f"Solicitando novo link de pagamento: {body}")
-    response = requests.post(SISTEMA_PAGAMENTO_URL, json=body)
-
-    if response.status_code == 200:
-        body = json.dumps({
-            'lei_id': json_data['lei_id'],
-            'cli_id': json_data['cli_id'],
-            'link_pagamento': response.json().get('link_pagamento', '')
-        })
-        ch.basic_publish(
-            exchange=EXCHANGE_NAME,
-            routing_key=ROUTING_KEY_LINK_PAGAMENTO,
-            body=body
-        )
-        print(f"link de pagamento recebido: {body}")
-    
-    else:
-        print(f"Erro ao solicitar pagamento: {response.status_code} - {response.text}")
+    } for _, _, json_data in pendentes]
+    print(f"Solicitando {len(body)} links de pagamento")
+    try:
+        response = clienteHttp.post(SISTEMA_PAGAMENTOS_URL, json=body)
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"{response.status_code} - {response.text}", response=response)
+        resultados = response.json() if response.status_code == 200 else None
+        # um resultado por pedido, na mesma ordem; do contrario nao da para casar link e entrega
+        if resultados is not None and (not isinstance(resultados, list) or len(resultados) != len(pendentes)):
+            raise ValueError(f"resposta com quantidade de resultados diferente dos {len(pendentes)} pedidos")
+    except (requests.RequestException, ValueError) as e:
+        if tentativa >= MAX_TENTATIVAS:
+            # devolve para a fila; o broker reentrega mais tarde
+            print(f"Desistindo de {len(pendentes)} links apos {tentativa} tentativas: {e}")
+            for ch, delivery_tag, _ in pendentes:
+                devolve(ch, delivery_tag)
+                resolvidos.add(delivery_tag)
+            return
+        atraso = BACKOFF_INICIAL * 2 ** (tentativa - 1)
+        print(f"Erro ao contatar sistema de pagamento ({e}), nova tentativa em {atraso}s")
+        resolvidos.update(delivery_tag for _, delivery_tag, _ in pendentes)
+        threading.Timer(atraso, executor.submit, (tarefa_links, pendentes, tentativa + 1)).start()
+        return
+
+    if response.status_code != 200:
+        # lote recusado (4xx): tentar de novo nao muda a resposta
+        print(f"Erro ao solicitar pagamentos: {response.status_code} - {response.text}")
+        for ch, delivery_tag, _ in pendentes:
+            confirma(ch, delivery_tag)
+            resolvidos.add(delivery_tag)
+        return
+
+    for (ch, delivery_tag, json_data), resultado in zip(pendentes, resultados):
+        if resultado['status'] != 200:
+            print(f"Erro ao solicitar pagamento de {json_data['lei_id']}: {resultado.get('error')}")
+            confirma(ch, delivery_tag)
+            resolvidos.add(delivery_tag)
+            continue
+        links_pagamento[(json_data['lei_id'], json_data['cli_id'])] = resultado['link_pagamento']
+        publica_link(ch, delivery_tag, json_data, resultado['link_pagamento'])
+        resolvidos.add(delivery_tag)
 
 def main():
     # abre conexao e exchange para publicar mensagens
@@ -83,8 +204,11 @@ def main():
     queue_name = f'leilao_vencedor_pagamento_ms'
     channel.queue_declare(queue=queue_name)
     channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=ROUTING_KEY_LEILAO_VENCEDOR)
-    channel.basic_consume(queue=queue_name, on_message_callback=process_leilao_vencedor, auto_ack=True)
+    channel.basic_qos(prefetch_count=PREFETCH)
+    channel.basic_consume(queue=queue_name, on_message_callback=process_leilao_vencedor)
 
+    publisher.start()
+    lote_vencedores.start()
     threading.Thread(target=runFlaskApp, daemon=True).start()
 
     print("Esperando mensagens de leilao ou lances...")
@@ -92,6 +216,10 @@ def main():
         channel.start_consuming()
     except (KeyboardInterrupt, EOFError):
         channel.stop_consuming()
+    lote_vencedores.stop()
+    executor.shutdown(wait=False, cancel_futures=True)
+    publisher.flush(timeout=5)
+    publisher.stop()
     connection.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,205 @@
+# Publicador compartilhado pelos microsservicos da Atividade 4.
+#
+# Mantem uma unica conexao longa com o RabbitMQ em uma thread de I/O dedicada
+# (pika.SelectConnection). Qualquer thread (rotas Flask, callbacks de consumo,
+# agendador) chama publish(), que apenas coloca a mensagem em uma fila thread-safe.
+# A thread de I/O publica em lotes com publisher confirms e guarda as mensagens ainda
+# nao confirmadas; se a conexao cair ela reconecta sozinha e republica o que ficou sem
+# confirmacao (entrega ao menos uma vez). O numero de conexoes por servico fica
+# constante, nao importa quantos leiloes estejam rodando.
+#
+# Uso:
+#     import publicador
+#     publisher = publicador.Publisher()
+#     publisher.start()
+#     publisher.publish('lance_validado', json.dumps(body))
+
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+import pika
+
+RABBITMQ_HOST = 'localhost'
+EXCHANGE_NAME = 'leilao_exchange'
+EXCHANGE_TYPE = 'direct'
+
+BATCH_SIZE = 256  # mensagens publicadas por rodada da thread de I/O
+DRAIN_INTERVAL = 0.05  # segundos, rede de seguranca caso um aviso de nova mensagem se perca
+RECONNECT_DELAY = 1.0  # segundos entre tentativas de reconexao
+
+class Publisher:
+    def __init__(self, host=RABBITMQ_HOST, exchange=EXCHANGE_NAME, exchange_type=EXCHANGE_TYPE):
+        self.parameters = pika.ConnectionParameters(host)
+        self.exchange = exchange
+        self.exchange_type = exchange_type
+
+        self.outbox = queue.Queue()
+        # mensagens a republicar antes das novas (nack ou conexao perdida)
+        self.retry = deque()
+        # delivery_tag -> (routing_key, body, properties, on_confirm) ainda sem confirmacao do broker
+        self.unconfirmed = OrderedDict()
+        self.delivery_tag = 0
+
+        self.connection = None
+        self.channel = None
+        self.ready = False
+        self.wake_pending = False
+        self.stopping = False
+        self.idle = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='publicador')
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def publish(self, routing_key, body, properties=None, on_confirm=None):
+        # on_confirm roda na thread de I/O quando o broker confirmar a mensagem; deve ser rapido
+        self.outbox.put((routing_key, body, properties, on_confirm))
+        self._wake()
+
+    def flush(self, timeout=None):
+        # espera ate todas as mensagens enfileiradas serem confirmadas pelo broker
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.idle:
+            while not self.outbox.empty() or self.retry or self.unconfirmed:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.idle.wait(remaining)
+        return True
+
+    def stop(self):
+        self.stopping = True
+        connection = self.connection
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(self._close)
+        self.thread.join(timeout=5)
+
+    def _wake(self):
+        connection = self.connection
+        if self.ready and not self.wake_pending and connection is not None:
+            self.wake_pending = True
+            try:
+                connection.ioloop.add_callback_threadsafe(self._drain)
+            except (RuntimeError, AttributeError):
+                # ioloop ja fechado; o timer de reconexao publica depois
+                self.wake_pending = False
+
+    def _run(self):
+        while not self.stopping:
+            self.connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed,
+            )
+            self.connection.ioloop.start()
+            if not self.stopping:
+                time.sleep(RECONNECT_DELAY)
+
+    def _close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        else:
+            self.connection.ioloop.stop()
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        print(f"Erro ao conectar publicador ao RabbitMQ: {error!r}")
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self.ready = False
+        self.channel = None
+        # o que nao foi confirmado volta para a frente da fila, na ordem original
+        self.retry.extendleft(reversed(list(self.unconfirmed.values())))
+        self.unconfirmed.clear()
+        if not self.stopping:
+            print(f"Conexao do publicador perdida, reconectando: {reason}")
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.exchange_declare(
+            exchange=self.exchange,
+            exchange_type=self.exchange_type,
+            callback=self._on_exchange_declared,
+        )
+
+    def _on_channel_closed(self, channel, reason):
+        self.ready = False
+        self.channel = None
+        if self.connection.is_open:
+            self.connection.close()
+
+    def _on_exchange_declared(self, frame):
+        self.channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation, callback=self._on_confirm_selected)
+
+    def _on_confirm_selected(self, frame):
+        self.delivery_tag = 0
+        self.ready = True
+        self._schedule_drain()
+        self._drain()
+
+    def _schedule_drain(self):
+        if self.ready:
+            self.connection.ioloop.call_later(DRAIN_INTERVAL, self._periodic_drain)
+
+    def _periodic_drain(self):
+        self._drain()
+        self._schedule_drain()
+
+    def _next_message(self):
+        if self.retry:
+            return self.retry.popleft()
+        return self.outbox.get_nowait()
+
+    def _drain(self):
+        self.wake_pending = False
+        if not self.ready:
+            return
+        for _ in range(BATCH_SIZE):
+            try:
+                message = self._next_message()
+            except queue.Empty:
+                break
+            routing_key, body, properties, _ = message
+            self.channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=routing_key,
+                body=body,
+                properties=properties,
+            )
+            self.delivery_tag += 1
+            self.unconfirmed[self.delivery_tag] = message
+        else:
+            # ainda ha mensagens: continua na proxima volta do ioloop sem travar os confirms
+            self.wake_pending = True
+            self.connection.ioloop.add_callback_threadsafe(self._drain)
+
+    def _on_delivery_confirmation(self, frame):
+        method = frame.method
+        if method.multiple:
+            # tags entram em ordem crescente: so percorre o prefixo confirmado, nao o dict todo
+            confirmed = []
+            while self.unconfirmed and next(iter(self.unconfirmed)) <= method.delivery_tag:
+                confirmed.append(self.unconfirmed.popitem(last=False)[1])
+        else:
+            message = self.unconfirmed.pop(method.delivery_tag, None)
+            confirmed = [] if message is None else [message]
+        if isinstance(method, pika.spec.Basic.Nack):
+            # o broker recusou, tenta de novo
+            print(f"{len(confirmed)} mensagens recusadas pelo broker, republicando")
+            self.retry.extend(confirmed)
+            self._wake()
+        else:
+            for _, _, _, on_confirm in confirmed:
+                if on_confirm is not None:
+                    on_confirm()
+        with self.idle:
+            self.idle.notify_all()
@@ -1,4 +1,4 @@
-import requests
+import notificadorStatus
 
 # app.py
 from flask import Flask, request, jsonify
@@ -9,31 +9,62 @@ CORS(app)
 def runFlaskApp():
     app.run(port=5004, debug=True, use_reloader=False)
 
-PAGAMENTO_MS_URL = 'http://127.0.0.1:5003/status_pagamento'
+PAGAMENTO_MS_URL = 'http://127.0.0.1:5003/status_pagamentos'
+
+# webhooks de status saem por uma fila persistida, enviados em lote por uma thread propria
+notificador = notificadorStatus.StatusNotifier(PAGAMENTO_MS_URL)
 
 pagamentos = {}
 
+CAMPOS_PAGAMENTO = ("lei_id", "cli_id", "valor", "moeda")
+
+def registra_pagamento(json_data):
+    # idempotente por (lei_id, cli_id): um pedido repetido devolve o mesmo link sem
+    # registrar outra cobranca nem reabrir um pagamento ja processado
+    pagamentos.setdefault((json_data['lei_id'], json_data['cli_id']), {
+        'valor': json_data['valor'],
+        'moeda': json_data['moeda'],
+        'status': 'pendente'
+    })
+    return f"http://127.0.0.1:5004/pagar?lei_id={json_data['lei_id']}&cli_id={json_data['cli_id']}"
+
 @app.post("/novo_pagamento")
 def process_novo_pagamento():
     json_data = request.get_json()
 
-    if "lei_id" not in json_data or "cli_id" not in json_data or "valor" not in json_data or "moeda" not in json_data:
+    if any(campo not in json_data for campo in CAMPOS_PAGAMENTO):
         return {"error": "Campos faltando na requisicao"}, 400
 
-    pagamentos[(json_data['lei_id'], json_data['cli_id'])] = {
-        'valor': json_data['valor'],
-        'moeda': json_data['moeda'],
-        'status': 'pendente'
-    }
+    link_pagamento = registra_pagamento(json_data)
     print(pagamentos[(json_data['lei_id'], json_data['cli_id'])])
-
-    link_pagamento = f"http://127.0.0.1:5004/pagar?lei_id={json_data['lei_id']}&cli_id={json_data['cli_id']}"
     body = {
         "link_pagamento": link_pagamento
     }
 
     return jsonify(body), 200
 
+@app.post("/novos_pagamentos")
+def process_novos_pagamentos():
+    # lote de pagamentos: um resultado por item, na ordem recebida
+    json_data = request.get_json(silent=True)
+    if not isinstance(json_data, list):
+        return {"error": "Esperado um array de pagamentos"}, 400
+
+    resultados = []
+    for index, item in enumerate(json_data):
+        if not isinstance(item, dict) or any(campo not in item for campo in CAMPOS_PAGAMENTO):
+            resultados.append({"index": index, "status": 400, "error": "Campos faltando na requisicao"})
+            continue
+        resultados.append({
+            "index": index,
+            "status": 200,
+            "lei_id": item['lei_id'],
+            "cli_id": item['cli_id'],
+            "link_pagamento": registra_pagamento(item),
+        })
+    print(f"{len(json_data)} pagamentos recebidos em lote")
+    return jsonify(resultados), 200
+
 @app.post("/pagar")
 def process_pagar():
     json_data = request.get_json()
@@ -66,23 +97,23 @@ def process_pagar():
         "status": status
     }
     print(body)
-    response = requests.post(PAGAMENTO_MS_URL, json=body)
+    # decisao registrada e notificacao gravada na fila de saida; o comprador nao espera a entrega
     pagamentos[(lei_id, cli_id)]['status'] = status
+    notificador.enqueue(body)
 
-    if status == 'aprovado' and response.status_code == 200:
+    if status == 'aprovado':
         return {"status": "Pagamento aprovado com sucesso"}, 200
     else:
-        if response.status_code == 200:
-            return {"status": f"Pagamento {status}"}, 200
-        else:
-            return {"error": "Erro ao notificar status do pagamento"}, 500
+        return {"status": f"Pagamento {status}"}, 200
 
 
 def main():
+    notificador.start()
     try:
         runFlaskApp()
     except (KeyboardInterrupt, EOFError):
         pass
+    notificador.stop()
 
 if __name__ == '__main__':
     main()